@@ -0,0 +1,507 @@
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from supabase import acreate_client, create_client, AsyncClient, AsyncClientOptions, ClientOptions
+from user_state import UserStateReplica, LastKnownState
+from breaker import CircuitBreaker
+from moderation import make_verdict_cache, make_local_moderator, AsyncModerationBatcher
+from kudos_writer import KudosWriter
+from delivery import DeliveryScheduler
+from digest import DigestBuffer, describe_interval
+from groups import MembershipIndex, make_bot_directory, format_target, KUDOS_MAX_GROUP_SIZE
+from leaderboard import Leaderboard
+from metrics import timed_handler, register_cache, start_metrics_server, TimedWebClient, TimedAsyncWebClient
+from tracing import traced, async_bolt_middleware
+from preflight import run_preflight_async
+from idempotency import IdempotencyStore, request_key
+from user_data import is_admin, parse_command, export_to_file, erase_user
+from transport import make_http_client, make_async_http_client, start_warmer, run_async_warmer
+from blocks import get_rules_block, help_blocks, stat_blocks, kudos_modal, return_kudos_modal, modal_notice, leaderboard_blocks
+from kudos_core import KudosCore, run_async
+from kudos_text import parse_give_kudos, leaderboard_window, kudos_sent_text, give_kudos_blocked_reply, view_blocked_text, erased_text
+
+# asyncio version of main.py. same handlers, but on AsyncApp so one process can have a
+# lot of kudos in flight without a thread each. run with `python async_main.py` or
+# `KUDOS_RUNTIME=async python main.py`
+
+load_dotenv()
+
+SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
+SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+MODERATION_URL = os.getenv("MODERATION_URL")
+MODERATION_KEY = os.getenv("MODERATION_KEY")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+KUDOS_MAX_RECIPIENTS = int(os.getenv("KUDOS_MAX_RECIPIENTS", "20"))
+
+
+# handlers share one async keep-alive pool, the background threads a sync one. see transport.py
+async_http_client = make_async_http_client()
+http_client = make_http_client()
+
+# acreate_client is a coroutine, so this gets filled in by main()
+supabase: AsyncClient = None
+
+app=AsyncApp(client=TimedAsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL))
+# one trace per request, see tracing.py
+app.use(async_bolt_middleware)
+
+mod_client=AsyncOpenAI(
+    base_url=MODERATION_URL,
+    api_key=MODERATION_KEY,
+    http_client=async_http_client
+)
+
+# the replica and the kudos writer work from their own threads, so they share a sync client
+sync_supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http_client))
+user_state = UserStateReplica(sync_supabase)
+local_moderator = make_local_moderator()
+verdict_cache = make_verdict_cache()
+# concurrent checks share moderation calls, see moderation.py
+moderation_batcher = AsyncModerationBatcher(mod_client)
+register_cache("moderation", lambda: (verdict_cache.hits, verdict_cache.misses))
+register_cache("gate_state", lambda: (user_state.hits, user_state.misses))
+kudos_writer = KudosWriter(sync_supabase)
+leaderboard = Leaderboard(sync_supabase)
+# delivery runs on its own worker threads too, so it gets a sync WebClient
+# when supabase is down the gate answers from the last values it saw, see breaker.py
+last_known = LastKnownState()
+gate_breaker = CircuitBreaker("supabase_gate", lambda: sync_supabase.table("kudos_opt_out").select("user_id").limit(1).execute())
+# shared by every worker process, see fleet.py
+idempotency = IdempotencyStore()
+delivery = DeliveryScheduler(TimedWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL))
+
+
+# the gate, moderation, opt-out and delivery logic is shared with main.py, see kudos_core.py
+core = KudosCore(supabase, user_state, last_known, gate_breaker, local_moderator, verdict_cache, moderation_batcher, kudos_writer, leaderboard, delivery)
+# people who turned on /kudos-digest get their kudos in one DM per interval, see digest.py
+digest = DigestBuffer(core.send_digest)
+core.digest = digest
+# who's in each user group and channel, for kudos to a whole team. uses the sync client, see groups.py
+membership = MembershipIndex(delivery.client, bots=make_bot_directory(SLACK_BOT_TOKEN, SLACK_API_URL))
+
+
+async def gate_blocker(sender_id, recipient_id):
+    return await run_async(core.gate_blocker(sender_id, recipient_id))
+
+async def check_if_opt_out(user_id):
+    return await run_async(core.check_if_opt_out(user_id))
+
+async def fetch_opted_out(user_ids, fallback=True):
+    return await run_async(core.fetch_opted_out(user_ids, fallback))
+
+async def fetch_kudos_stats(user_id):
+    return await run_async(core.fetch_kudos_stats(user_id))
+
+async def save_usr_agreement(user_id):
+    return await run_async(core.save_usr_agreement(user_id))
+
+async def if_txt_flagged(text):
+    return await run_async(core.if_txt_flagged(text))
+
+async def add_to_opt_out_table(user_id):
+    return await run_async(core.add_to_opt_out_table(user_id))
+
+async def remove_from_opt_out_table(user_id):
+    return await run_async(core.remove_from_opt_out_table(user_id))
+
+kudos_data_collector = core.kudos_data_collector
+send_kudos_dm = core.send_kudos_dm
+
+@app.action("button-action")
+async def agreement_handler(ack, respond, body):
+    await ack()
+    user_id = body["user"]["id"]
+
+    if await save_usr_agreement(user_id):
+        await respond(text="Thank you for agreeing! You can now send kudos! :neocat_cute:", replace_original=True)
+    else:
+        await respond(text="Error when saving the agreement. Please try again soon.", replace_original=True)
+
+@app.command("/opt-out")
+async def opt_out_cmd(ack, command, respond):
+    await ack()
+    user_id = command["user_id"]
+
+    if await check_if_opt_out(user_id):
+        await respond(text="You have already opted out!", replace_original=False)
+        return
+
+    if await add_to_opt_out_table(user_id):
+        await respond(text="You have opt-out. You will no longer recieve kudos or send kudos to a user. :neocat_sad_reach:", replace_original=False)
+    else:
+        await respond("Error when trying to opt-out. Please try again.")
+
+@app.command("/opt-in")
+async def opt_in_cmd(ack, respond, command):
+    await ack()
+    user_id = command["user_id"]
+
+    if await check_if_opt_out(user_id):
+        await respond(text=":neocat_cute: You are already opted in! ", replace_original=False)
+        return
+
+    if await remove_from_opt_out_table(user_id):
+        await respond(
+            text=":neocat_box: Welcome back! You've successfully opted in. To start sending kudos again, please review and agree to the guidelines below!",
+            blocks=get_rules_block()
+        )
+    else:
+        await respond(text="Oops! Something went wrong while trying to opt you back in. Please try again later. :neocat_sad_reach:")
+
+@app.command("/kudos-help")
+async def help_cmd(ack, respond):
+    await ack()
+
+    await respond(blocks=help_blocks())
+
+
+@app.command("/kudos-leaderboard")
+@timed_handler("/kudos-leaderboard")
+async def leaderboard_cmd(ack, command):
+    # rendered from memory, so it's answered right in the ack
+    window = leaderboard_window(command.get("text"))
+
+    # opted out users don't show up on it. until the replica has loaded that's one query for
+    # the people on the board, and if supabase can't answer it the board waits too
+    users = leaderboard.users(window)
+    hidden = await fetch_opted_out(users, fallback=False) if leaderboard.ready else None
+    if hidden is None:
+        await ack(text="The leaderboard is still loading, try again in a minute! :neocat_blank:")
+        return
+
+    await ack(blocks=leaderboard_blocks(window, leaderboard.top(window, skip=hidden, among=users)))
+
+
+@app.command("/kudos-digest")
+async def digest_cmd(ack, command):
+    # a local sqlite lookup, so it's answered right in the ack
+    user_id = command["user_id"]
+    choice = (command.get("text") or "").strip().lower()
+    every = describe_interval(digest.interval)
+
+    try:
+        if choice == "on":
+            digest.enable(user_id)
+            await ack(text=f"Digest mode is on! From now on you'll get all your kudos in one DM every {every}. :neocat_cute:")
+        elif choice == "off":
+            digest.disable(user_id)
+            await ack(text="Digest mode is off! Anything waiting for your digest is on its way now, and new kudos will come right away. :neocat_heart:")
+        elif digest.wants(user_id):
+            await ack(text=f"You're getting your kudos in one DM every {every}. Turn that off with `/kudos-digest off`.")
+        else:
+            await ack(text=f"You're getting every kudos as it's sent. Run `/kudos-digest on` to get them in one DM every {every} instead.")
+    except Exception as e:
+        print(f"Error when changing digest mode! {e}")
+        await ack(text="Oops! Unable to change your digest setting right now. Please try again later. :neocat_sad_reach:")
+
+
+async def ack_command(ack):
+    await ack()
+
+@timed_handler("/my-kudos")
+@traced("/my-kudos")
+async def kudos_cmd(command, respond):
+    user_id = command["user_id"]
+
+    if await check_if_opt_out(user_id):
+        await respond(text="You have opted out and your unable to see your stats. Please opt-in to see your stats! :neocat_blank:")
+        return
+
+    stats = await fetch_kudos_stats(user_id)
+
+    if stats is None:
+        await respond(text="Oops! Unable to load your stats right now. Please try again later. :neocat_sad_reach:")
+        return
+
+    await respond(blocks=stat_blocks(stats))
+
+app.command("/my-kudos")(ack=ack_command, lazy=[kudos_cmd])
+
+
+async def data_cmd_ack(ack, command):
+    if not is_admin(command["user_id"]):
+        await ack(text="Only kudos admins can export or erase data. To have your own data removed, please DM @areallyawesomeusername :neocat_blank:")
+        return
+    if parse_command(command.get("text")) is None:
+        await ack(text="Usage: `/kudos-data export @user` or `/kudos-data erase @user`")
+        return
+    await ack(text="On it! I'll let you know when it's done. :neocat_cute:")
+
+@timed_handler("/kudos-data")
+@traced("/kudos-data")
+async def data_cmd(command, respond):
+    # streams and deletes in pages with the sync client on a thread, see user_data.py
+    admin_id = command["user_id"]
+    parsed = parse_command(command.get("text"))
+    if not is_admin(admin_id) or parsed is None:
+        return
+    action, user_id = parsed
+
+    try:
+        if action == "export":
+            with tempfile.TemporaryDirectory() as directory:
+                path, written = await asyncio.to_thread(export_to_file, sync_supabase, user_id, directory)
+                channel = (await app.client.conversations_open(users=admin_id))["channel"]["id"]
+                await app.client.files_upload_v2(channel=channel, file=path, filename=os.path.basename(path), initial_comment=f"Kudos data for <@{user_id}> ({written} rows)")
+            await respond(text=f"Sent you <@{user_id}>'s data in a DM. :neocat_heart:")
+            return
+
+        deleted = await asyncio.to_thread(erase_user, sync_supabase, user_id, digest=digest, writer=kudos_writer)
+        user_state.mark_not_agreed(user_id)
+        last_known.mark(user_id, agreed=False)
+        await asyncio.to_thread(leaderboard.reconcile)
+    except Exception as e:
+        print(f"Error when running /kudos-data {action} for {user_id}! {e}")
+        await respond(text=f"Oops! Unable to {action} <@{user_id}>'s data. Please try again later. :neocat_sad_reach:")
+        return
+
+    await respond(text=erased_text(user_id, deleted))
+
+app.command("/kudos-data")(ack=data_cmd_ack, lazy=[data_cmd])
+
+
+@timed_handler("/give-kudos")
+@traced("/give-kudos")
+async def give_a_kudo(command, client, respond, context):
+    sender_id = command["user_id"]
+    txt = command["text"]
+
+    recipient_ids, targets, reason = parse_give_kudos(txt)
+
+    if not recipient_ids and not targets:
+        await respond("Please mention a user, user group or channel to give kudos to.")
+        return
+
+    skipped = {}
+
+    if sender_id in recipient_ids:
+        recipient_ids.remove(sender_id)
+        skipped[sender_id] = "that's you"
+
+    if not recipient_ids and not targets:
+        await respond(text='You cannot give kudos to yourself. :neocat_laugh:')
+        return
+
+    if len(recipient_ids) > KUDOS_MAX_RECIPIENTS:
+        await respond(f"You can give kudos to up to {KUDOS_MAX_RECIPIENTS} people at once. :neocat_sad_reach:")
+        return
+
+    # the reason is moderated once for everybody and all the opt-outs come back in one query.
+    # user groups and channels get expanded here too, side by side with the other checks
+    opted_out = set()
+    resolved = list(recipient_ids)
+
+    async def recipients_opted_out():
+        if targets:
+            try:
+                # the membership index pages through slack with the sync client, see groups.py
+                members = await asyncio.to_thread(membership.resolve, targets)
+            except Exception as e:
+                print(f"Unable to look up group members {e}")
+                return "group_unavailable"
+            resolved[:] = [user_id for user_id in dict.fromkeys(recipient_ids + members) if user_id not in (sender_id, context.bot_user_id)]
+            if not resolved:
+                return "group_empty"
+            if len(resolved) > KUDOS_MAX_GROUP_SIZE:
+                return "group_too_big"
+            if not await asyncio.to_thread(membership.includes, targets, sender_id):
+                return "not_a_member"
+        opted_out.update(await fetch_opted_out(resolved))
+        # only blocks when there's nobody left to send to
+        return len(opted_out) == len(resolved)
+
+    blocked = await run_preflight_async({
+        "gate": gate_blocker(sender_id, None),
+        "flagged": if_txt_flagged(reason),
+        "recipient_opted_out": recipients_opted_out(),
+    })
+
+    reply = give_kudos_blocked_reply(blocked, resolved)
+    if reply:
+        await respond(**reply)
+        return
+
+    # people mentioned by name are listed when they're skipped, group members are just counted
+    for recipient_id in recipient_ids:
+        if recipient_id in opted_out:
+            skipped[recipient_id] = "opted out"
+    skipped_members = len(opted_out - set(recipient_ids))
+    named = [f"<@{recipient_id}>" for recipient_id in recipient_ids if recipient_id not in opted_out]
+    recipient_ids = [recipient_id for recipient_id in resolved if recipient_id not in opted_out]
+
+    # slack retries envelopes, so make sure a kudos only goes out once across the whole fleet
+    if not idempotency.claim(request_key(command)):
+        return
+
+    try:
+        kudos_data_collector(sender_id, recipient_ids, reason)
+        # every DM is its own job, the delivery workers send them side by side
+        for recipient_id in recipient_ids:
+            send_kudos_dm(sender_id, recipient_id, reason)
+        targets_named = named + [format_target(kind, target_id) for kind, target_id in targets] if targets else ()
+        await respond(kudos_sent_text(recipient_ids, skipped, targets_named, skipped_members))
+    except Exception as e:
+        await respond(f"Oops! Unable to send a kudos to the recipient. :( {e}")
+
+app.command("/give-kudos")(ack=ack_command, lazy=[give_a_kudo])
+
+@app.shortcut("give_kudos_shortcut")
+async def kudo_shortcut_modal(ack, shortcut, client, body):
+    await ack()
+
+    trigger_id = shortcut["trigger_id"]
+    recipient_id = shortcut["message"]["user"]
+    sender_id = body["user"]["id"]
+
+    if sender_id == recipient_id:
+        await client.chat_postEphemeral(
+            channel=body["channel"]["id"],
+            user=sender_id,
+            text="You cannot give kudos to yourself! :neocat_laugh:"
+        )
+        return
+
+    await client.views_open(
+        trigger_id=trigger_id,
+        view=kudos_modal(recipient_id)
+    )
+
+
+async def ack_kudos_view(ack, view):
+    await ack(response_action="update", view=modal_notice(view["title"], "Sending your kudos... :neocat_cute:"))
+
+async def send_kudos_from_view(client, body, view, typed_reason, default_reason, build_modal):
+    sender_id = body["user"]["id"]
+    recipient_id = view["private_metadata"]
+
+    async def reject(error):
+        await client.views_update(view_id=view["id"], view=build_modal(recipient_id, typed_reason, error))
+
+    if sender_id == recipient_id:
+        await reject("You cannot give kudos to yourself!")
+        return
+
+    reason = typed_reason or default_reason
+
+    blocked = await run_preflight_async({
+        "gate": gate_blocker(sender_id, recipient_id),
+        "flagged": if_txt_flagged(reason),
+    })
+
+    error = view_blocked_text(blocked, recipient_id)
+    if error:
+        await reject(error)
+        return
+
+    if not idempotency.claim(request_key(body, view)):
+        return
+
+    try:
+        kudos_data_collector(sender_id, [recipient_id], reason)
+        send_kudos_dm(sender_id, recipient_id, reason)
+        await client.views_update(view_id=view["id"], view=modal_notice(view["title"], f"Your kudos to <@{recipient_id}> is on its way! :neocat_heart:"))
+    except Exception as e:
+        print(f"Error sending the kudos! {e}")
+        await client.views_update(view_id=view["id"], view=modal_notice(view["title"], "Oops! Unable to send a kudos to the recipient. :("))
+
+@timed_handler("submit_kudos_view")
+@traced("submit_kudos_view")
+async def handle_submission(client, body, view):
+    typed_reason = view["state"]["values"]["reason_block"]["reason_action"]["value"]
+    await send_kudos_from_view(client, body, view, typed_reason, "being awesome!", kudos_modal)
+
+app.view("submit_kudos_view")(ack=ack_kudos_view, lazy=[handle_submission])
+
+@timed_handler("return_kudos_submission")
+@traced("return_kudos_submission")
+async def return_submission_handler(client, body, view):
+    typed_reason = view["state"]["values"]["return_reason_block"]["reason_action"]["value"]
+    await send_kudos_from_view(client, body, view, typed_reason, "returning the favor!", return_kudos_modal)
+
+app.view("return_kudos_submission")(ack=ack_kudos_view, lazy=[return_submission_handler])
+
+
+# keep the membership index honest between refreshes
+@app.event("member_joined_channel")
+async def member_joined_channel(event):
+    membership.invalidate("channel", event["channel"])
+
+@app.event("member_left_channel")
+async def member_left_channel(event):
+    membership.invalidate("channel", event["channel"])
+
+@app.event("subteam_members_changed")
+async def subteam_members_changed(event):
+    membership.invalidate("subteam", event["subteam_id"])
+
+# and the bot list, so new bots are left out right away. deactivations wait for the next
+# users.list walk, user_change fires on every profile and status edit and is too busy to follow
+@app.event("team_join")
+async def team_join(event):
+    membership.bots.note(event["user"])
+
+
+@app.action("return_kudos")
+async def return_kudos_handler(ack, body, client):
+    await ack()
+    trigger_id = body["trigger_id"]
+    origin_sender = body["actions"][0]["value"]
+
+    await client.views_open(
+        trigger_id=trigger_id,
+        view=return_kudos_modal(origin_sender)
+    )
+
+
+@app.action("opt_out")
+async def opt_out_handler(ack, body, respond):
+    await ack()
+    user_id = body["user"]["id"]
+
+    try:
+        if await add_to_opt_out_table(user_id):
+            await respond(
+                text="You have opt-out. You will no longer recieve kudos or send kudos to a user.",
+                replace_original=False
+            )
+        else:
+            await respond(
+                text="You are already opted out.",
+                replace_original=False
+            )
+    except Exception as e:
+        await respond(f"Unable to opt-out :( {e}")
+
+
+async def main():
+    global supabase
+    supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY, options=AsyncClientOptions(httpx_client=async_http_client))
+    # the async client is made inside the loop, so core only gets it now
+    core.supabase = supabase
+    start_metrics_server()
+    await run_async_warmer(async_http_client, [f"{SUPABASE_URL}/rest/v1/", MODERATION_URL])
+    start_warmer(http_client, [f"{SUPABASE_URL}/rest/v1/"])
+    user_state.start()
+    kudos_writer.start()
+    leaderboard.start()
+    delivery.start()
+    digest.start()
+    membership.bots.start()
+    await AsyncSocketModeHandler(app, SLACK_APP_TOKEN).start_async()
+
+def run():
+    # same as main.py, SIGTERM becomes a normal exit so the kudos writer flushes
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run()
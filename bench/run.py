@@ -0,0 +1,215 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from slack_bolt.context import BoltContext
+from stubs import PostgrestStub, ModerationStub, SlackStub
+
+# offline latency benchmark for the kudos hot path. starts local stand-ins for supabase,
+# the moderation api and slack, points main.py at them and calls the handlers directly.
+#
+#   python bench/run.py --iterations 200 --moderation-latency-ms 80
+#
+# latency is measured until the handler returns. external calls are everything the stubs
+# saw for that handler, including the background writes and DMs it queued, divided by the
+# number of runs.
+
+SENDER = "U0SENDER"
+FAKE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYmVuY2gifQ.YmVuY2g"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def start_stubs(args):
+    postgrest = PostgrestStub(args.supabase_latency_ms).start()
+    moderation = ModerationStub(args.moderation_latency_ms, slow_every=args.moderation_slow_every, slow_ms=args.moderation_slow_ms).start()
+    slack = SlackStub(args.slack_latency_ms, args.group_size, SENDER).start()
+
+    postgrest.seed("user_agreements", [{"user_id": SENDER}] + [{"user_id": f"U{i:06d}"} for i in range(args.iterations)])
+    postgrest.seed("kudos_opt_out", [{"user_id": "U0OPTEDOUT"}])
+    postgrest.seed("collect_kudos", [{"sender_id": SENDER, "recipient_id": f"U{i % 50:06d}", "reason": "seed"} for i in range(args.history)])
+
+    workdir = tempfile.mkdtemp(prefix="kudos-bench-")
+    os.environ.update({
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_APP_TOKEN": "xapp-bench",
+        "SLACK_API_URL": f"{slack.url}/api/",
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": FAKE_KEY,
+        "MODERATION_URL": f"{moderation.url}/v1",
+        "MODERATION_KEY": "bench",
+        "KUDOS_SPILL_PATH": os.path.join(workdir, "spill.db"),
+        "DELIVERY_DEAD_LETTER_PATH": os.path.join(workdir, "dead_letter.jsonl"),
+        "KUDOS_IDEMPOTENCY_PATH": os.path.join(workdir, "idempotency.db"),
+        "KUDOS_DIGEST_PATH": os.path.join(workdir, "digest.db"),
+        # the slack stub never rate limits, so don't let the delivery queue pace itself like it does
+        "DELIVERY_POST_RATE": "1000",
+        # and let the group case thank more than the default cap
+        "KUDOS_MAX_GROUP_SIZE": str(max(args.group_size, 100)),
+    })
+    return postgrest, moderation, slack
+
+
+def wait_for_background(main, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if main.kudos_writer.pending() == 0 and main.delivery.pending() == 0:
+            time.sleep(0.05)
+            if main.kudos_writer.pending() == 0 and main.delivery.pending() == 0:
+                return
+        time.sleep(0.02)
+    print("warning: background work still pending after the handler runs")
+
+
+def make_respond(slack):
+    from slack_bolt.context.respond import Respond
+    return Respond(response_url=f"{slack.url}/respond")
+
+
+def run_case(name, main, stubs, iterations, call, concurrency=1):
+    for stub in stubs:
+        stub.calls.clear()
+
+    def timed(i):
+        started = time.perf_counter()
+        call(i)
+        return (time.perf_counter() - started) * 1000
+
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed, range(iterations)))
+    else:
+        samples = [timed(i) for i in range(iterations)]
+    wait_for_background(main)
+
+    calls = {stub.name: stub.total_calls() / iterations for stub in stubs}
+    return {
+        "handler": name,
+        "n": iterations,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "mean": statistics.fmean(samples),
+        "calls": calls,
+    }
+
+
+def print_report(results, stubs):
+    names = [stub.name for stub in stubs]
+    header = f"{'handler':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + "".join(f"{name + '/op':>16}" for name in names)
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        line = f"{result['handler']:<28}{result['n']:>6}{result['p50']:>10.2f}{result['p95']:>10.2f}{result['p99']:>10.2f}"
+        line += "".join(f"{result['calls'][name]:>16.2f}" for name in names)
+        print(line)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Offline latency benchmark for the KudosGiver handlers")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--history", type=int, default=1000, help="kudos rows to seed collect_kudos with")
+    parser.add_argument("--supabase-latency-ms", type=float, default=20)
+    parser.add_argument("--moderation-latency-ms", type=float, default=60)
+    parser.add_argument("--moderation-slow-every", type=int, default=0, help="make every Nth moderation call slow")
+    parser.add_argument("--moderation-slow-ms", type=float, default=3000, help="how much slower those calls are")
+    parser.add_argument("--slack-latency-ms", type=float, default=30)
+    parser.add_argument("--replica", action="store_true", help="load the opt-out/agreement replica first")
+    parser.add_argument("--concurrency", type=int, default=1, help="handlers running at the same time")
+    parser.add_argument("--recipients", type=int, default=1, help="people mentioned in each /give-kudos")
+    parser.add_argument("--repeat-reasons", action="store_true", help="reuse one reason so the moderation cache gets hits")
+    parser.add_argument("--group-size", type=int, default=500, help="members in the channel thanked by the group case (0 skips it)")
+    args = parser.parse_args()
+
+    stubs = start_stubs(args)
+    slack = stubs[2]
+
+    import main
+
+    if args.replica:
+        main.user_state.load()
+    main.leaderboard.reconcile()
+
+    respond = make_respond(slack)
+    client = main.app.client
+    context = BoltContext(bot_user_id="U0BOT")
+
+    def reason(i, case):
+        return "thanks for the help!" if args.repeat_reasons else f"thanks for the help with {case} #{i}!"
+
+    def recipient(i):
+        return f"U{i:06d}"
+
+    def mentions(i):
+        return [f"<@{recipient((i * args.recipients + n) % args.iterations)}|someone>" for n in range(args.recipients)]
+
+    def give_kudos(i):
+        main.give_a_kudo(
+            command={"user_id": SENDER, "text": " ".join(mentions(i)) + " " + reason(i, "command")},
+            client=client,
+            say=None,
+            respond=respond,
+            context=context,
+        )
+
+    def give_group_kudos(i):
+        main.give_a_kudo(
+            command={"user_id": SENDER, "text": "<#C0BENCH|team> " + reason(i, "group")},
+            client=client,
+            say=None,
+            respond=respond,
+            context=context,
+        )
+
+    def modal_view(callback_id, block_id, i):
+        return {
+            "id": f"V{callback_id[:6].upper()}{i:06d}",
+            "callback_id": callback_id,
+            "title": {"type": "plain_text", "text": "KudosGiver"},
+            "private_metadata": recipient(i),
+            "state": {"values": {block_id: {"reason_action": {"value": reason(i, callback_id)}}}},
+        }
+
+    def submit_view(i):
+        main.handle_submission(client=client, body={"user": {"id": SENDER}}, view=modal_view("submit_kudos_view", "reason_block", i))
+
+    def return_view(i):
+        main.return_submission_handler(body={"user": {"id": SENDER}}, client=client, view=modal_view("return_kudos_submission", "return_reason_block", i))
+
+    def my_kudos(i):
+        main.kudos_cmd(command={"user_id": SENDER}, respond=respond)
+
+    def leaderboard(i):
+        main.leaderboard_cmd(ack=lambda **kwargs: None, command={"user_id": SENDER, "text": ("week", "month", "all")[i % 3]})
+
+    results = [
+        run_case("/give-kudos", main, stubs, args.iterations, give_kudos, args.concurrency),
+        run_case("submit_kudos_view", main, stubs, args.iterations, submit_view, args.concurrency),
+        run_case("return_kudos_submission", main, stubs, args.iterations, return_view, args.concurrency),
+        run_case("/my-kudos", main, stubs, args.iterations, my_kudos, args.concurrency),
+        run_case("/kudos-leaderboard", main, stubs, args.iterations, leaderboard, args.concurrency),
+    ]
+    if args.group_size:
+        # every call DMs the whole channel, so a handful of them is plenty
+        results.append(run_case(f"/give-kudos #{args.group_size}", main, stubs, min(args.iterations, 5), give_group_kudos))
+
+    print(f"supabase {args.supabase_latency_ms}ms, moderation {args.moderation_latency_ms}ms, slack {args.slack_latency_ms}ms, replica {'on' if args.replica else 'off'}, concurrency {args.concurrency}")
+    print_report(results, stubs)
+
+    for stub in stubs:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,325 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# local stand-ins for the three services the bot talks to. they keep everything in memory,
+# sleep for a configurable latency before answering and count every request they get.
+
+
+class StubServer:
+    name = "stub"
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def count(self, key):
+        with self._lock:
+            self.calls[key] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"{self.name}-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method, path, query, headers, body):
+        raise NotImplementedError
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, response_headers, payload = stub.handle(self.command, parts.path, parse_qsl(parts.query), self.headers, raw)
+                data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for key, value in response_headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _serve
+
+        return Handler
+
+
+def _order(rows, order):
+    for part in reversed((order or "").split(",")):
+        if part:
+            column, _, direction = part.partition(".")
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith("desc"))
+
+
+def _split(conditions):
+    # the top level commas of an or=(...) or and(...) list, quoted values kept whole
+    parts, current, depth, quoted = [], "", 0, False
+    for char in conditions:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "()":
+            depth += 1 if char == "(" else -1
+        elif not quoted and char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    return parts + [current]
+
+
+def _matches_any(row, conditions, combine):
+    # or=(a.gt.1,and(b.eq.2,c.gt.3))
+    results = []
+    for condition in _split(conditions.strip()[1:-1]):
+        if condition.startswith(("and(", "or(")):
+            name, _, rest = condition.partition("(")
+            results.append(_matches_any(row, "(" + rest, all if name == "and" else any))
+        else:
+            column, _, expression = condition.partition(".")
+            results.append(_matches(row, [(column, expression.replace('"', ""))]))
+    return combine(results)
+
+
+def _matches(row, filters):
+    for column, expression in filters:
+        if column in ("or", "and"):
+            if not _matches_any(row, expression, any if column == "or" else all):
+                return False
+            continue
+        op, _, value = expression.partition(".")
+        current = row.get(column)
+        if op == "eq" and str(current) != value:
+            return False
+        if op == "neq" and str(current) == value:
+            return False
+        if op == "in" and str(current) not in value.strip("()").split(","):
+            return False
+        if op in ("gt", "gte", "lt", "lte"):
+            if current is None:
+                return False
+            left, right = (current, int(value)) if isinstance(current, int) else (str(current), value)
+            if op == "gt" and not left > right:
+                return False
+            if op == "gte" and not left >= right:
+                return False
+            if op == "lt" and not left < right:
+                return False
+            if op == "lte" and not left <= right:
+                return False
+    return True
+
+
+class PostgrestStub(StubServer):
+    # just enough of PostgREST for collect_kudos, user_agreements, kudos_opt_out and the
+    # kudos_gate_state / kudos_leaderboard_counts / kudos_user_stats rpcs: eq/in/gt/gte/lt/lte filters, order, limit/offset, exact counts.
+    name = "postgrest"
+    reserved = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+    def __init__(self, latency_ms=0):
+        super().__init__(latency_ms)
+        self.tables = {"collect_kudos": [], "user_agreements": [], "kudos_opt_out": [], "kudos_state_tombstones": []}
+        self._ids = Counter()
+        self._data_lock = threading.Lock()
+
+    def seed(self, table, rows):
+        with self._data_lock:
+            for row in rows:
+                self._insert(table, row)
+
+    def _insert(self, table, row):
+        row = dict(row)
+        self._ids[table] += 1
+        row.setdefault("id", self._ids[table])
+        row.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()))
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def rpc(self, name, args):
+        if name == "kudos_gate_state":
+            opted_out = {row["user_id"] for row in self.tables["kudos_opt_out"]}
+            agreed = {row["user_id"] for row in self.tables["user_agreements"]}
+            recipient = args.get("recipient")
+            return {
+                "sender_opted_out": args["sender"] in opted_out,
+                "sender_agreed": args["sender"] in agreed,
+                "recipient_opted_out": recipient is not None and recipient in opted_out,
+            }
+        if name == "kudos_leaderboard_counts":
+            counts = Counter()
+            for row in self.tables["collect_kudos"]:
+                if args.get("since") is None or row["created_at"] >= args["since"][:19]:
+                    counts[("sender", row["sender_id"])] += 1
+                    counts[("recipient", row["recipient_id"])] += 1
+            return [{"role": role, "user_id": user_id, "kudos": kudos} for (role, user_id), kudos in counts.items()]
+        if name == "kudos_user_stats":
+            stats = {f"{role}_{window}": 0 for role in ("sent", "received") for window in ("week", "month", "all")}
+            thanked = Counter()
+            for row in self.tables["collect_kudos"]:
+                for role, column in (("sent", "sender_id"), ("received", "recipient_id")):
+                    if row[column] != args["target"]:
+                        continue
+                    stats[f"{role}_all"] += 1
+                    stats[f"{role}_month"] += row["created_at"][:10] >= args["month_start"]
+                    stats[f"{role}_week"] += row["created_at"][:10] >= args["week_start"]
+                if row["sender_id"] == args["target"]:
+                    thanked[row["recipient_id"]] += 1
+            stats["top_thanked"] = [{"user_id": user_id, "kudos": kudos} for user_id, kudos in thanked.most_common(args.get("top_n", 3))]
+            return stats
+        return None
+
+    def handle(self, method, path, query, headers, body):
+        if not path.startswith("/rest/v1/"):
+            return 404, {}, {"message": "not found"}
+        name = path[len("/rest/v1/"):]
+
+        if name.startswith("rpc/"):
+            self.count(f"rpc.{name[4:]}")
+            with self._data_lock:
+                result = self.rpc(name[4:], json.loads(body or b"{}"))
+            if result is None:
+                return 404, {}, {"message": f"function {name[4:]} not found"}
+            if isinstance(result, list):
+                params = dict(query)
+                _order(result, params.get("order"))
+                offset = int(params.get("offset", 0))
+                result = result[offset:offset + int(params["limit"])] if "limit" in params else result[offset:]
+            return 200, {}, result
+
+        self.count(f"{method.lower()}.{name}")
+        params = dict(query)
+        filters = [(k, v) for k, v in query if k not in self.reserved]
+        prefer = headers.get("Prefer") or ""
+
+        with self._data_lock:
+            rows = self.tables.setdefault(name, [])
+            if method == "POST":
+                payload = json.loads(body or b"[]")
+                payload = payload if isinstance(payload, list) else [payload]
+                conflict = params.get("on_conflict")
+                if conflict and "resolution=ignore-duplicates" in prefer:
+                    # ON CONFLICT DO NOTHING, null keys never conflict
+                    taken = {row.get(conflict) for row in rows} - {None}
+                    payload = [row for row in payload if row.get(conflict) is None or row[conflict] not in taken]
+                inserted = [self._insert(name, row) for row in payload]
+                return 201, {}, inserted if "return=representation" in prefer else None
+
+            matched = [row for row in rows if _matches(row, filters)]
+
+            if method == "DELETE":
+                for row in matched:
+                    rows.remove(row)
+                return 200, {}, matched if "return=representation" in prefer else None
+
+            _order(matched, params.get("order"))
+
+            total = len(matched)
+            offset = int(params.get("offset", 0))
+            limit = params.get("limit")
+            matched = matched[offset:offset + int(limit)] if limit is not None else matched[offset:]
+
+            response_headers = {}
+            if "count=" in prefer:
+                response_headers["Content-Range"] = f"{offset}-{offset + max(len(matched) - 1, 0)}/{total}" if matched else f"*/{total}"
+
+            columns = params.get("select", "*")
+            if columns != "*":
+                wanted = [column.strip() for column in columns.split(",")]
+                matched = [{column: row.get(column) for column in wanted} for row in matched]
+            return 200, response_headers, matched
+
+
+class ModerationStub(StubServer):
+    # OpenAI compatible /moderations. anything containing one of flagged_words gets flagged.
+    # every slow_every-th call takes slow_ms longer, for a latency tail
+    name = "moderation"
+
+    def __init__(self, latency_ms=0, flagged_words=("badword",), slow_every=0, slow_ms=0):
+        super().__init__(latency_ms)
+        self.flagged_words = flagged_words
+        self.slow_every = slow_every
+        self.slow = slow_ms / 1000
+
+    def handle(self, method, path, query, headers, body):
+        if not path.endswith("/moderations"):
+            return 404, {}, {"error": {"message": "not found"}}
+        self.count("moderations")
+        if self.slow_every and self.calls["moderations"] % self.slow_every == 0:
+            time.sleep(self.slow)
+        request = json.loads(body or b"{}")
+        inputs = request.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        results = []
+        for text in inputs:
+            flagged = any(word in text.lower() for word in self.flagged_words)
+            results.append({"flagged": flagged, "categories": {}, "category_scores": {}, "category_applied_input_types": {}})
+        return 200, {}, {"id": "modr-bench", "model": "omni-moderation-latest", "results": results}
+
+
+class SlackStub(StubServer):
+    # fake Slack Web API. every method says ok, response_url posts land on /respond.
+    # every user group and channel has group_size members plus the sender (you can only thank
+    # a team you're in), conversations.members pages them
+    name = "slack"
+    members_page = 200
+
+    def __init__(self, latency_ms=0, group_size=0, sender=None):
+        super().__init__(latency_ms)
+        self.members = ([sender] if sender else []) + ["U0OPTEDOUT"] + [f"U{i:06d}" for i in range(max(0, group_size - 1))] if group_size else []
+
+    def handle(self, method, path, query, headers, body):
+        if path.startswith("/respond"):
+            self.count("respond")
+            return 200, {}, {"ok": True}
+        api_method = path.rsplit("/", 1)[-1]
+        self.count(api_method)
+        if api_method == "auth.test":
+            return 200, {}, {"ok": True, "url": "https://bench.slack.com/", "team": "bench", "user": "kudosgiver", "team_id": "T0BENCH", "user_id": "U0BOT", "bot_id": "B0BOT"}
+        if api_method in ("chat.postMessage", "chat.postEphemeral"):
+            return 200, {}, {"ok": True, "channel": "D0BENCH", "ts": f"{time.time():.6f}"}
+        if api_method in ("views.open", "views.update"):
+            return 200, {}, {"ok": True, "view": {"id": "V0BENCH"}}
+        if api_method == "users.list":
+            return 200, {}, {"ok": True, "members": [{"id": "U0BOT", "is_bot": True}, {"id": "U0GONE", "deleted": True}]}
+        if api_method == "usergroups.users.list":
+            return 200, {}, {"ok": True, "users": self.members}
+        if api_method == "conversations.members":
+            params = dict(query)
+            if body:
+                params.update(parse_qsl(body.decode()))
+            start = int(params.get("cursor") or 0)
+            end = start + self.members_page
+            return 200, {}, {"ok": True, "members": self.members[start:end], "response_metadata": {"next_cursor": str(end) if end < len(self.members) else ""}}
+        return 200, {}, {"ok": True}
@@ -0,0 +1,654 @@
+import json
+import re
+from collections import Counter
+from metrics import registry, Histogram
+
+# block kit payloads. static ones are built once at import and shared (don't mutate them),
+# dynamic ones are BlockTemplates. everything is passed as lists, the slack sdk serializes the
+# whole request body once.
+
+SLOT = re.compile(r"\{\{(\w+)\}\}")
+
+payload_bytes = registry.register(Histogram(
+    "kudos_block_payload_bytes", "Size of the blocks in each message, as slack receives them.", ["surface"],
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384)))
+
+
+def payload_size(blocks):
+    # bytes of json, the way the slack sdk sends it
+    return len(json.dumps(blocks, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def _slot_tree(node):
+    # where the {{slots}} are: {key: subtree}, down to the split strings. None if there's no slot
+    if isinstance(node, str):
+        parts = SLOT.split(node)
+        return parts if len(parts) > 1 else None
+    items = enumerate(node) if isinstance(node, list) else node.items() if isinstance(node, dict) else ()
+    tree = {key: subtree for key, subtree in ((key, _slot_tree(value)) for key, value in items) if subtree is not None}
+    return tree or None
+
+
+def _fill(node, tree, values):
+    if isinstance(tree, list):
+        # even indexes are literal text, odd indexes are slot names
+        return "".join(values[part] if i % 2 else part for i, part in enumerate(tree))
+    node = list(node) if isinstance(node, list) else dict(node)
+    for key, subtree in tree.items():
+        node[key] = _fill(node[key], subtree, values)
+    return node
+
+
+class BlockTemplate:
+    # a message with {{slots}} in its strings. the slots are found once, and render only copies
+    # the lists and dicts on the way down to one, everything else is shared between messages.
+    # size() is the payload size without building or serializing anything.
+
+    def __init__(self, name, blocks):
+        self.name = name
+        self.blocks = blocks
+        self.tree = _slot_tree(blocks)
+        slots = [part for parts in self._leaves(self.tree) for part in parts[1::2]]
+        self.slot_counts = Counter(slots)
+        self.base_size = payload_size(_fill(blocks, self.tree, dict.fromkeys(slots, "")))
+
+    def _leaves(self, tree):
+        if isinstance(tree, list):
+            yield tree
+            return
+        for subtree in tree.values():
+            yield from self._leaves(subtree)
+
+    def render(self, **values):
+        values = {slot: str(value) for slot, value in values.items()}
+        payload_bytes.observe(self.size(**values), surface=self.name)
+        return _fill(self.blocks, self.tree, values)
+
+    def size(self, **values):
+        # json escaping is the only thing that can make a value longer than itself
+        return self.base_size + sum(
+            count * (len(json.dumps(str(values[slot]), ensure_ascii=False).encode("utf-8")) - 2)
+            for slot, count in self.slot_counts.items()
+        )
+
+
+RULES_BLOCKS = [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": ":neocat_book: *Community Guidelines*"
+        }
+    },
+    {
+        "type": "divider"
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "Before you send your first kudos to your buddy, please follow these rules and reminders!",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "1. Be respectful!",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "2. No inappropriate content. Moderation is in place.",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "3. Kudos's messages will be logged for safety.",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "4. Please follow the <https://hack.af/coc|Code of Conduct> when sending kudos!"
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "Note on our collection policy: Your Slack ID and timestamp will be logged when you agreed to these guidelines. This information will be saved into a Supabase table. We will also collect your Slack ID, the recipient's Slack ID and the kudos reason into a seperate Supabase table. We use this information for safety purposes. If any Fire Department member asks for this information, we'll gladly hand it over to them. If you would like your data to be removed, please DM @areallyawesomeusername",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "Please note that the moderation system is powered by OpenAI models. It not might be accurate and some harmful messages might slip through. If you encounter any harmful messages, please file a Shroud report or contact a FD member.",
+            "emoji": True
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "plain_text",
+            "text": "By agreeing to these guidelines, you allow us to collect the information listed in our collection policy and will follow the guidelines above.",
+            "emoji": True
+        }
+    },
+    {
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "I agree to the above.",
+                    "emoji": True
+                },
+                "value": "agree_button",
+                "action_id": "button-action"
+            }
+        ]
+    }
+]
+
+
+def get_rules_block():
+    # shared list, don't mutate it
+    return RULES_BLOCKS
+
+
+HELP_BLOCKS = [
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "KudosGiver Help :neocat_book: ",
+			"emoji": True
+		}
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/give-kudos @User|@group|#channel [...] Reason",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "Give kudos to a friend, a few of them, or a whole user group or channel!",
+				"emoji": True
+			}
+		]
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/opt-out",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "Opt-out of the kudos system. :neocat_sad:",
+				"emoji": True
+			}
+		]
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/opt-in",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "Opt-in of the kudos system.",
+				"emoji": True
+			}
+		]
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/my-kudos",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "Check how many kudos you recieved and sent!",
+				"emoji": True
+			}
+		]
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/kudos-leaderboard [week|month|all]",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "See who gave and got the most kudos!",
+				"emoji": True
+			}
+		]
+	},
+	{
+		"type": "section",
+		"text": {
+			"type": "plain_text",
+			"text": "/kudos-digest [on|off]",
+			"emoji": True
+		}
+	},
+	{
+		"type": "context",
+		"elements": [
+			{
+				"type": "plain_text",
+				"text": "Get all your kudos in one DM every few hours instead of one at a time!",
+				"emoji": True
+			}
+		]
+	}
+]
+
+
+def help_blocks():
+    return HELP_BLOCKS
+
+
+STAT_WINDOWS = (
+    ("week", "This Week"),
+    ("month", "This Month"),
+    ("all", "All Time"),
+)
+
+
+def stat_blocks(stats):
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": "Your Kudos Stats! :neocat_heart:",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"*{title}*\nSent: {stats[f'sent_{window}']}\nReceived: {stats[f'received_{window}']}"
+                }
+                for window, title in STAT_WINDOWS
+            ]
+        }
+    ]
+    if stats.get("top_thanked"):
+        blocks.append(_ranking("You've Thanked the Most", [(entry["user_id"], entry["kudos"]) for entry in stats["top_thanked"]]))
+    blocks += [
+        {
+            "type": "divider"
+        },
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "plain_text",
+                    "text": "Keep on sending kudos!",
+                    "emoji": True
+                }
+            ]
+        }
+    ]
+    return blocks
+
+
+LEADERBOARD_TITLES = {
+    "week": "This Week",
+    "month": "This Month",
+    "all": "All Time",
+}
+
+
+def _ranking(title, entries):
+    lines = [f"{rank}. <@{user_id}> ({count})" for rank, (user_id, count) in enumerate(entries, 1)]
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"*{title}*\n" + ("\n".join(lines) if lines else "No kudos yet!")
+        }
+    }
+
+
+def leaderboard_blocks(window, top):
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": f"Kudos Leaderboard, {LEADERBOARD_TITLES[window]} :neocat_heart:",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        _ranking("Most Kudos Received", top["recipient"]),
+        _ranking("Most Kudos Sent", top["sender"]),
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "plain_text",
+                    "text": "Try /kudos-leaderboard week, month or all",
+                    "emoji": True
+                }
+            ]
+        }
+    ]
+
+
+OPT_OUT_BUTTON = {
+    "type": "button",
+    "text": {
+        "type": "plain_text",
+        "text": "Opt-out :neocat_sad_reach: ",
+        "emoji": True
+    },
+    "style": "danger",
+    "value": "opt_out_action",
+    "action_id": "opt_out",
+    "confirm": {
+        "title": {
+            "type": "plain_text",
+            "text": "Opt-out?"
+        },
+        "text": {
+            "type": "plain_text",
+            "text": "Are you sure you want to opt-out? You won't be able to send or recieve kudos anymore."
+        },
+        "confirm": {
+            "type": "plain_text",
+            "text": "Yes, opt-out"
+        },
+        "deny": {
+            "type": "plain_text",
+            "text": "Cancel"
+        }
+    }
+}
+
+KUDOS_MESSAGE_TEMPLATE = BlockTemplate("kudos_dm", [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": ":neocat_heart: *You received a kudos from <@{{sender_id}}>*\n\n> {{reason}}"
+        }
+    },
+    {
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Return the favor :neocat_hug:",
+                    "emoji": True
+                },
+                "value": "{{sender_id}}",
+                "action_id": "return_kudos"
+            },
+            OPT_OUT_BUTTON
+        ]
+    }
+])
+
+
+def kudos_message_blocks(sender_id, reason):
+    return KUDOS_MESSAGE_TEMPLATE.render(sender_id=sender_id, reason=reason)
+
+
+# slack allows 50 blocks per message and 3000 characters per section
+DIGEST_MAX_SENDERS = 45
+SECTION_LIMIT = 3000
+
+
+def group_by_sender(kudos):
+    # [(sender_id, reason), ...] -> {sender_id: [reason, ...]}, in the order they came in
+    senders = {}
+    for sender_id, reason in kudos:
+        senders.setdefault(sender_id, []).append(reason)
+    return senders
+
+
+def digest_text(kudos):
+    senders = group_by_sender(kudos)
+    people = "person" if len(senders) == 1 else "people"
+    return f":neocat_heart: You received {len(kudos)} kudos from {len(senders)} {people}!"
+
+
+def digest_blocks(kudos):
+    # one section per sender with their own "Return the favor" button
+    senders = group_by_sender(kudos)
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{digest_text(kudos)}*"
+            }
+        },
+        {
+            "type": "divider"
+        }
+    ]
+    for sender_id, reasons in list(senders.items())[:DIGEST_MAX_SENDERS]:
+        text = f"*From <@{sender_id}>*\n" + "\n".join(f"> {reason}" for reason in reasons)
+        if len(text) > SECTION_LIMIT:
+            text = text[:SECTION_LIMIT - 1] + "…"
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": text
+            },
+            "accessory": {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Return the favor :neocat_hug:",
+                    "emoji": True
+                },
+                "value": sender_id,
+                "action_id": "return_kudos"
+            }
+        })
+    if len(senders) > DIGEST_MAX_SENDERS:
+        blocks.append({
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"...and kudos from {len(senders) - DIGEST_MAX_SENDERS} more people!"
+                }
+            ]
+        })
+    blocks.append({
+        "type": "actions",
+        "elements": [OPT_OUT_BUTTON]
+    })
+    return blocks
+
+
+def kudos_modal(recipient_id, reason=None, error=None):
+    reason_element = {
+        "type": "plain_text_input",
+        "action_id": "reason_action"
+    }
+    if reason:
+        reason_element["initial_value"] = reason
+
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*You are about to give a kudos to <@{recipient_id}>*"
+            }
+        },
+        {
+            "type": "input",
+            "block_id" : "reason_block",
+            "element": reason_element,
+            "label": {
+                "type": "plain_text",
+                "text": "Reason",
+                "emoji": True
+            },
+            "optional": True
+        }
+    ]
+    if error:
+        blocks.append(modal_error_block(error))
+
+    return {
+    "type": "modal",
+    "callback_id" : "submit_kudos_view",
+    "private_metadata" : recipient_id,
+    "title": {
+        "type": "plain_text",
+        "text": "KudosGiver",
+        "emoji": True
+    },
+    "submit": {
+        "type": "plain_text",
+        "text": "Give Kudos",
+        "emoji": True
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Cancel",
+        "emoji": True
+    },
+    "blocks": blocks
+}
+
+def return_kudos_modal(origin_sender, reason=None, error=None):
+    reason_element = {
+        "type": "plain_text_input",
+        "action_id": "reason_action"
+    }
+    if reason:
+        reason_element["initial_value"] = reason
+
+    blocks = [
+        {
+            "type": "input",
+            "block_id": "return_reason_block",
+            "element": reason_element,
+            "label": {
+                "type": "plain_text",
+                "text": "Reason",
+                "emoji": True
+            },
+            "optional": True
+        }
+    ]
+    if error:
+        blocks.append(modal_error_block(error))
+
+    return {
+    "type": "modal",
+    "callback_id": "return_kudos_submission",
+    "private_metadata": origin_sender,
+    "title": {
+        "type": "plain_text",
+        "text": "Return Kudos",
+        "emoji": True
+    },
+    "submit": {
+        "type": "plain_text",
+        "text": "Send Back",
+        "emoji": True
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Cancel",
+        "emoji": True
+    },
+    "blocks": blocks
+}
+
+def modal_error_block(error):
+    return {
+        "type": "context",
+        "elements": [
+            {
+                "type": "mrkdwn",
+                "text": f":neocat_0_0: {error}"
+            }
+        ]
+    }
+
+def modal_notice(title, text):
+    return {
+    "type": "modal",
+    "title": title,
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+        "emoji": True
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": text
+            }
+        }
+    ]
+}
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from metrics import registry, Counter, Gauge
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_PROBE_SECONDS = float(os.getenv("BREAKER_PROBE_SECONDS", "5"))
+
+_breakers = {}
+
+breaker_rejections = registry.register(Counter(
+    "kudos_breaker_rejections_total", "Calls skipped because their circuit breaker was open.", ["breaker"]))
+registry.register(Gauge(
+    "kudos_breaker_open", "1 while a circuit breaker is open.", ["breaker"],
+    callback=lambda: {(name,): int(breaker.open) for name, breaker in _breakers.items()}))
+
+
+class CircuitBreaker:
+    # opens after `failures` calls in a row fail. while it's open callers skip the backend
+    # completely (and use whatever they know already), and a background probe keeps trying a
+    # cheap request until one works, which closes it again. request traffic never probes, so
+    # nobody waits on a timeout while the backend is down.
+
+    def __init__(self, name, probe, failures=BREAKER_FAILURES, probe_seconds=BREAKER_PROBE_SECONDS):
+        self.name = name
+        self.probe = probe
+        self.failures = failures
+        self.probe_seconds = probe_seconds
+        self.open = False
+        self._failed = 0
+        self._lock = threading.Lock()
+        _breakers[name] = self
+
+    def allow(self):
+        if self.open:
+            breaker_rejections.inc(breaker=self.name)
+            return False
+        return True
+
+    def success(self):
+        self._failed = 0
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            if self.open or self._failed < self.failures:
+                return
+            self.open = True
+        print(f"Circuit breaker {self.name} is open, using last known values until it recovers")
+        threading.Thread(target=self._probe_until_closed, name=f"breaker-{self.name}", daemon=True).start()
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.probe_seconds)
+            try:
+                self.probe()
+            except Exception as e:
+                print(f"Circuit breaker {self.name} probe failed {e}")
+                continue
+            with self._lock:
+                self.open = False
+                self._failed = 0
+            print(f"Circuit breaker {self.name} is closed again")
+            return
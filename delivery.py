@@ -0,0 +1,227 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from slack_sdk.errors import SlackApiError
+from metrics import registry, Counter
+import tracing
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_POST_RATE = float(os.getenv("DELIVERY_POST_RATE", "5"))
+DEAD_LETTER_PATH = os.getenv("DELIVERY_DEAD_LETTER_PATH", "kudos_dead_letter.jsonl")
+# slack's limits are per app, so fleet.py gives each of its workers 1 / FLEET_WORKERS of them
+RATE_SHARE = float(os.getenv("DELIVERY_RATE_SHARE", "1"))
+
+deliveries = registry.register(Counter(
+    "kudos_delivery_total", "Slack calls from the delivery queue, by what happened to them.", ["method", "result"]))
+
+# calls per second for each slack rate limit tier. chat.postMessage has its own "special"
+# tier: about 1 per second per channel plus a workspace wide cap, that's what "post" is.
+TIER_RATES = {
+    "tier1": 1 / 60,
+    "tier2": 20 / 60,
+    "tier3": 50 / 60,
+    "tier4": 100 / 60,
+    "post": DELIVERY_POST_RATE,
+}
+
+METHOD_TIERS = {
+    "chat_postMessage": "post",
+    "chat_postEphemeral": "post",
+    "views_open": "tier4",
+    "views_update": "tier4",
+    "conversations_open": "tier3",
+}
+
+# gap between two messages to the same channel
+PER_CHANNEL_SECONDS = 1.0
+
+# errors slack sends with ok=false that are worth another try, anything else is dead lettered
+TRANSIENT_ERRORS = {
+    "ratelimited",
+    "internal_error",
+    "fatal_error",
+    "service_unavailable",
+    "request_timeout",
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait_for = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class DeliveryJob:
+    def __init__(self, method, kwargs, on_failure=None):
+        self.method = method
+        self.kwargs = kwargs
+        self.on_failure = on_failure
+        self.attempts = 0
+        # the span that queued it, so the send shows up in the same trace
+        self.trace = tracing.current()
+
+
+class DeliveryScheduler:
+    # outbound queue for slack calls. jobs for the same channel go out one at a time and in
+    # order, every method is paced by a token bucket for its tier, 429s pause that method for
+    # Retry-After, and jobs that keep failing end up in a dead letter file.
+
+    def __init__(self, client, workers=DELIVERY_WORKERS, max_attempts=DELIVERY_MAX_ATTEMPTS, dead_letter_path=DEAD_LETTER_PATH):
+        self.client = client
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self._buckets = {}
+        self._queues = {}
+        self._scheduled = set()
+        self._ready = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._dead_letter_lock = threading.Lock()
+
+    def _bucket(self, method):
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            bucket = self._buckets.setdefault(method, TokenBucket(TIER_RATES[METHOD_TIERS.get(method, "tier3")] * RATE_SHARE))
+        return bucket
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"delivery-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, method, on_failure=None, **kwargs):
+        self.start()
+        channel = kwargs.get("channel") or kwargs.get("user") or ""
+        with self._cond:
+            self._queues.setdefault(channel, deque()).append(DeliveryJob(method, kwargs, on_failure))
+            if channel not in self._scheduled:
+                self._schedule(channel, time.monotonic())
+
+    def pending(self):
+        with self._cond:
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    def _schedule(self, channel, ready_at):
+        # called with the lock held. a channel is either in the heap or being worked on, never both
+        self._scheduled.add(channel)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), channel))
+        self._cond.notify()
+
+    def _next_channel(self):
+        with self._cond:
+            while True:
+                if self._ready:
+                    ready_at, _, channel = self._ready[0]
+                    wait_for = ready_at - time.monotonic()
+                    if wait_for <= 0:
+                        heapq.heappop(self._ready)
+                        return channel, self._queues[channel][0]
+                    self._cond.wait(wait_for)
+                else:
+                    self._cond.wait()
+
+    def _finish(self, channel, retry_at=None):
+        with self._cond:
+            jobs = self._queues[channel]
+            if retry_at is not None:
+                self._schedule(channel, retry_at)
+                return
+            jobs.popleft()
+            if jobs:
+                self._schedule(channel, time.monotonic() + PER_CHANNEL_SECONDS)
+            else:
+                del self._queues[channel]
+                self._scheduled.discard(channel)
+
+    def _run(self):
+        while True:
+            channel, job = self._next_channel()
+            retry_at = self._deliver(job)
+            self._finish(channel, retry_at)
+
+    def _deliver(self, job):
+        # returns when to try again, or None when the job is done (sent or dead lettered)
+        bucket = self._bucket(job.method)
+        bucket.acquire()
+        job.attempts += 1
+        try:
+            with tracing.resume(job.trace), tracing.span(f"delivery.{job.method}", attempt=job.attempts):
+                getattr(self.client, job.method)(**job.kwargs)
+            deliveries.inc(method=job.method, result="sent")
+            return None
+        except SlackApiError as e:
+            status = e.response.status_code
+            error = e.response.get("error") if e.response is not None else None
+            if status == 429:
+                retry_after = float(e.response.headers.get("Retry-After") or e.response.headers.get("retry-after") or 1)
+                # rate limits are per method for the whole workspace, so pause everyone
+                bucket.pause(retry_after)
+                return self._retry(job, retry_after, f"rate limited, retry after {retry_after}s")
+            if error in TRANSIENT_ERRORS or status >= 500:
+                return self._retry(job, min(2 ** job.attempts, 30), error or f"http {status}")
+            self._dead_letter(job, error or f"http {status}")
+            return None
+        except Exception as e:
+            return self._retry(job, min(2 ** job.attempts, 30), str(e))
+
+    def _retry(self, job, delay, reason):
+        if job.attempts >= self.max_attempts:
+            self._dead_letter(job, reason)
+            return None
+        deliveries.inc(method=job.method, result="retried")
+        print(f"Delivery of {job.method} failed ({reason}), retrying in {delay}s")
+        return time.monotonic() + delay
+
+    def _dead_letter(self, job, reason):
+        deliveries.inc(method=job.method, result="dead_lettered")
+        print(f"Giving up on {job.method} after {job.attempts} tries :( {reason}")
+        with self._dead_letter_lock:
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps({
+                    "method": job.method,
+                    "kwargs": job.kwargs,
+                    "attempts": job.attempts,
+                    "error": reason,
+                    "failed_at": datetime.now(timezone.utc).isoformat(),
+                }, default=str) + "\n")
+        if job.on_failure:
+            try:
+                job.on_failure(reason)
+            except Exception as e:
+                print(f"Delivery failure callback failed {e}")
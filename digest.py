@@ -0,0 +1,178 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+DIGEST_PATH = os.getenv("KUDOS_DIGEST_PATH", "kudos_digest.db")
+DIGEST_SECONDS = float(os.getenv("KUDOS_DIGEST_SECONDS", "14400"))
+# how often the schedule is re-read, so digests buffered by another worker still go out if it stops
+RELOAD_SECONDS = 60
+
+
+def describe_interval(seconds):
+    if seconds >= 3600 and seconds % 3600 == 0:
+        hours = int(seconds // 3600)
+        return "hour" if hours == 1 else f"{hours} hours"
+    minutes = max(1, int(seconds // 60))
+    return "minute" if minutes == 1 else f"{minutes} minutes"
+
+
+class DigestBuffer:
+    # for people who'd rather get one "here's your kudos" DM every KUDOS_DIGEST_SECONDS than
+    # one DM per kudos. kudos for them are buffered in a local sqlite file, and the first one
+    # for a recipient schedules their digest. a heap of (due_at, recipient) tells the thread
+    # who's next, so it sleeps until then instead of scanning everyone.
+    #
+    # everything lives in the file, so a restart picks up where it left off. fleet workers
+    # share the file too, and whoever claims a recipient's row in digest_schedule sends it.
+
+    def __init__(self, send, path=DIGEST_PATH, interval=DIGEST_SECONDS):
+        # send(recipient_id, [(sender_id, reason), ...]) posts the digest
+        self.send = send
+        self.path = path
+        self.interval = interval
+        self.sent = 0
+        self._db = None
+        self._heap = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._loaded_at = 0.0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS digest_users (user_id TEXT PRIMARY KEY, since TEXT NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS digest_schedule (recipient_id TEXT PRIMARY KEY, due_at REAL NOT NULL)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS digest_kudos (seq INTEGER PRIMARY KEY AUTOINCREMENT, recipient_id TEXT NOT NULL,"
+            " sender_id TEXT NOT NULL, reason TEXT, created_at TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS digest_kudos_recipient_idx ON digest_kudos (recipient_id, seq)")
+        return db
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            if self._db is None:
+                self._db = self._connect()
+            return self._db.execute(sql, args)
+
+    def wants(self, user_id):
+        # asked for every kudos, a primary key lookup in a local file is cheap enough to not cache
+        try:
+            return self._execute("SELECT 1 FROM digest_users WHERE user_id = ?", (user_id,)).fetchone() is not None
+        except sqlite3.Error as e:
+            print(f"Unable to check digest mode, sending the kudos right away {e}")
+            return False
+
+    def enable(self, user_id):
+        self._execute("INSERT OR IGNORE INTO digest_users (user_id, since) VALUES (?, ?)", (user_id, datetime.now(timezone.utc).isoformat()))
+
+    def disable(self, user_id):
+        # whatever is buffered goes out now instead of waiting for the interval
+        self._execute("DELETE FROM digest_users WHERE user_id = ?", (user_id,))
+        if self._execute("UPDATE digest_schedule SET due_at = ? WHERE recipient_id = ?", (time.time(), user_id)).rowcount:
+            self._push(time.time(), user_id)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't both claim a digest
+        with self._lock:
+            if self._db is None:
+                self._db = self._connect()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def drop(self, recipient_id):
+        # someone who opted out doesn't get what was waiting for them either
+        with self._transaction() as db:
+            db.execute("DELETE FROM digest_schedule WHERE recipient_id = ?", (recipient_id,))
+            return db.execute("DELETE FROM digest_kudos WHERE recipient_id = ?", (recipient_id,)).rowcount
+
+    def erase(self, user_id):
+        # everything the file holds about someone, for user_data.erase_user. returns rows deleted
+        with self._transaction() as db:
+            deleted = db.execute("DELETE FROM digest_kudos WHERE recipient_id = ? OR sender_id = ?", (user_id, user_id)).rowcount
+            deleted += db.execute("DELETE FROM digest_schedule WHERE recipient_id = ?", (user_id,)).rowcount
+            deleted += db.execute("DELETE FROM digest_users WHERE user_id = ?", (user_id,)).rowcount
+            return deleted
+
+    def add(self, sender_id, recipient_id, reason):
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO digest_kudos (recipient_id, sender_id, reason, created_at) VALUES (?, ?, ?, ?)",
+                (recipient_id, sender_id, reason, datetime.now(timezone.utc).isoformat()),
+            )
+            scheduled = db.execute(
+                "INSERT OR IGNORE INTO digest_schedule (recipient_id, due_at) VALUES (?, ?)", (recipient_id, now + self.interval)
+            ).rowcount == 1
+        if scheduled:
+            self._push(now + self.interval, recipient_id)
+
+    def _push(self, due_at, recipient_id):
+        self.start()
+        with self._cond:
+            heapq.heappush(self._heap, (due_at, recipient_id))
+            self._cond.notify()
+
+    def _claim(self, recipient_id, now):
+        # takes the recipient's buffered kudos out of the file, or None when they aren't due
+        # (anymore). only one worker can win the delete on digest_schedule
+        with self._transaction() as db:
+            if db.execute("DELETE FROM digest_schedule WHERE recipient_id = ? AND due_at <= ?", (recipient_id, now)).rowcount == 0:
+                return None
+            rows = db.execute("SELECT sender_id, reason FROM digest_kudos WHERE recipient_id = ? ORDER BY seq", (recipient_id,)).fetchall()
+            db.execute("DELETE FROM digest_kudos WHERE recipient_id = ?", (recipient_id,))
+            return rows
+
+    def _load(self):
+        rows = self._execute("SELECT due_at, recipient_id FROM digest_schedule").fetchall()
+        with self._cond:
+            self._heap = [(due_at, recipient_id) for due_at, recipient_id in rows]
+            heapq.heapify(self._heap)
+            self._loaded_at = time.monotonic()
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                reload_in = self._loaded_at + RELOAD_SECONDS - time.monotonic()
+                if reload_in <= 0:
+                    return None
+                if self._heap and self._heap[0][0] <= time.time():
+                    return heapq.heappop(self._heap)[1]
+                wait_for = reload_in if not self._heap else min(reload_in, self._heap[0][0] - time.time())
+                self._cond.wait(wait_for)
+
+    def _run(self):
+        while True:
+            try:
+                recipient_id = self._next_due()
+                if recipient_id is None:
+                    self._load()
+                    continue
+                kudos = self._claim(recipient_id, time.time())
+                if kudos:
+                    self.send(recipient_id, kudos)
+                    self.sent += 1
+            except Exception as e:
+                print(f"Kudos digest failed {e}")
+                time.sleep(1)
+
+    def start(self):
+        if self._thread:
+            return
+        with self._cond:
+            if self._thread:
+                return
+            self._load()
+            self._thread = threading.Thread(target=self._run, name="kudos-digest", daemon=True)
+            self._thread.start()
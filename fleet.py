@@ -0,0 +1,111 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FLEET_WORKERS = int(os.getenv("FLEET_WORKERS", "2"))
+# slack hands out at most 10 socket mode connections per app
+MAX_WORKERS = 10
+# a worker that dies quicker than this counts as crashing, and gets restarted slower each time
+HEALTHY_SECONDS = 30
+MAX_BACKOFF_SECONDS = 60
+
+# runs several main.py processes, each with its own Socket Mode connection. slack spreads the
+# envelopes over every open connection, so losing one worker only costs its share until it's
+# restarted. kudos from retried envelopes are deduplicated by idempotency.py across the fleet.
+#
+#   FLEET_WORKERS=4 python fleet.py
+
+
+def per_worker(path, index):
+    # kudos_spill.db -> kudos_spill-2.db, so workers don't replay each other's files
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+
+def worker_env(index, workers):
+    env = dict(os.environ)
+    env["KUDOS_WORKER_ID"] = str(index)
+    env["KUDOS_SPILL_PATH"] = per_worker(os.getenv("KUDOS_SPILL_PATH", "kudos_spill.db"), index)
+    env["DELIVERY_DEAD_LETTER_PATH"] = per_worker(os.getenv("DELIVERY_DEAD_LETTER_PATH", "kudos_dead_letter.jsonl"), index)
+    env["TRACE_PATH"] = per_worker(os.getenv("TRACE_PATH", "kudos_traces.jsonl"), index)
+    # slack's rate limits are per app, so the workers split them instead of each using all of it
+    env["DELIVERY_RATE_SHARE"] = str(1 / workers)
+    # every worker has to reconcile its own leaderboard, but they take turns over the interval
+    env["LEADERBOARD_RECONCILE_OFFSET"] = str(index * float(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "600")) / workers)
+    # and worker 0 walks users.list for everybody
+    env["KUDOS_BOT_LIST_PATH"] = os.getenv("KUDOS_BOT_LIST_PATH", "kudos_bot_list.json")
+    metrics_port = os.getenv("METRICS_PORT", "9464")
+    if metrics_port:
+        env["METRICS_PORT"] = str(int(metrics_port) + index)
+    return env
+
+
+class Fleet:
+    def __init__(self, workers=FLEET_WORKERS):
+        if workers > MAX_WORKERS:
+            print(f"Slack allows {MAX_WORKERS} socket mode connections, running {MAX_WORKERS} workers instead of {workers}")
+        self.workers = max(1, min(workers, MAX_WORKERS))
+        self.script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        self.procs = {}
+        self.started_at = {}
+        self.restart_at = {}
+        self.crashes = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        self.procs[index] = subprocess.Popen([sys.executable, self.script], env=worker_env(index, self.workers))
+        self.started_at[index] = time.monotonic()
+        self.restart_at.pop(index, None)
+        print(f"Started worker {index} (pid {self.procs[index].pid})")
+
+    def check(self, index):
+        proc = self.procs[index]
+        if index in self.restart_at:
+            if time.monotonic() >= self.restart_at[index]:
+                self.spawn(index)
+            return
+        code = proc.poll()
+        if code is None:
+            return
+        if time.monotonic() - self.started_at[index] < HEALTHY_SECONDS:
+            self.crashes[index] = self.crashes.get(index, 0) + 1
+        else:
+            self.crashes[index] = 0
+        delay = min(2 ** self.crashes[index], MAX_BACKOFF_SECONDS) if self.crashes[index] else 1
+        print(f"Worker {index} exited with {code}, restarting in {delay}s")
+        self.restart_at[index] = time.monotonic() + delay
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self.stopping:
+            time.sleep(0.5)
+            for index in range(self.workers):
+                self.check(index)
+        self.shutdown()
+
+    def shutdown(self):
+        print("Stopping the fleet")
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        deadline = time.monotonic() + 15
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    Fleet().run()
@@ -0,0 +1,249 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from slack_sdk.http_retry import default_retry_handlers, RateLimitErrorRetryHandler
+from metrics import registry, Counter, TimedWebClient
+
+GROUP_CACHE_SECONDS = float(os.getenv("KUDOS_GROUP_CACHE_SECONDS", "300"))
+GROUP_CACHE_SIZE = int(os.getenv("KUDOS_GROUP_CACHE_SIZE", "256"))
+# every member gets a DM, and DMs go out at about DELIVERY_POST_RATE a second (5 by default)
+KUDOS_MAX_GROUP_SIZE = int(os.getenv("KUDOS_MAX_GROUP_SIZE", "100"))
+# how often the list of bots and deactivated accounts is walked again
+BOT_CACHE_SECONDS = float(os.getenv("KUDOS_BOT_CACHE_SECONDS", "3600"))
+# conversations.members takes up to 1000 per page
+PAGE_SIZE = 1000
+# users.list pages
+USERS_PAGE_SIZE = 200
+# fleet.py points its workers at one file, worker 0 walks users.list and the others read
+# what it found instead of each walking it again
+BOT_LIST_PATH = os.getenv("KUDOS_BOT_LIST_PATH")
+WORKER_ID = int(os.getenv("KUDOS_WORKER_ID", "0"))
+# always left out, even before the bot list is loaded
+UNKNOWN_BOTS = frozenset({"USLACKBOT"})
+
+# with should_escape on, slack sends user groups as <!subteam^S123|@team> and channels as <#C123|name>
+SUBTEAM_PATTERN = re.compile(r"<!subteam\^([A-Z0-9]+)(?:\|[^>]*)?>")
+CHANNEL_PATTERN = re.compile(r"<#([CG][A-Z0-9]+)(?:\|[^>]*)?>")
+
+lookups = registry.register(Counter(
+    "kudos_group_lookups_total", "User group and channel membership lookups, by whether the cache had them.", ["kind", "result"]))
+
+
+def find_targets(text):
+    # [("subteam", "S123"), ("channel", "C123"), ...] in the order they were mentioned, no repeats
+    found = [(match.start(), "subteam", match.group(1)) for match in SUBTEAM_PATTERN.finditer(text)]
+    found += [(match.start(), "channel", match.group(1)) for match in CHANNEL_PATTERN.finditer(text)]
+    return list(dict.fromkeys((kind, target_id) for _, kind, target_id in sorted(found)))
+
+
+def strip_targets(text):
+    return CHANNEL_PATTERN.sub("", SUBTEAM_PATTERN.sub("", text))
+
+
+def format_target(kind, target_id):
+    return f"<!subteam^{target_id}>" if kind == "subteam" else f"<#{target_id}>"
+
+
+class BotDirectory:
+    # bots and deactivated accounts in the workspace, so a kudos to a team doesn't DM them
+    # (every one of those DMs fails and tells the sender). one users.list walk every
+    # BOT_CACHE_SECONDS instead of a users.info per member, and team_join events keep it
+    # current in between (see note).
+    #
+    # nobody ever waits on the walk: it runs in the background, the old list is used until
+    # the new one is in, and before the first one finishes only slackbot is known. a bot
+    # that slips through just gets a DM that fails, same as before this existed.
+
+    def __init__(self, client, ttl=BOT_CACHE_SECONDS, shared_path=None, walks=True):
+        self.client = client
+        self.ttl = ttl
+        self.shared_path = shared_path
+        self.walks = walks
+        self._ids = None
+        self._expires_at = 0.0
+        self._walking = False
+        self._lock = threading.Lock()
+
+    def ids(self):
+        with self._lock:
+            if self._expires_at <= time.monotonic() and not self._walking:
+                self._walking = True
+                threading.Thread(target=self._walk, name="kudos-bot-directory", daemon=True).start()
+            return self._ids if self._ids is not None else UNKNOWN_BOTS
+
+    def refresh(self):
+        # walk users.list now, in this thread (or read the shared file, see _read_shared)
+        try:
+            ids, ttl = self._read_shared()
+            if ids is None:
+                ids, ttl = self._fetch(), self.ttl
+                self._write_shared(ids)
+        except Exception as e:
+            # keep whatever we had, try again in a minute
+            print(f"Unable to load the bot list {e}")
+            ids, ttl = None, 60
+        with self._lock:
+            if ids is not None:
+                self._ids = ids
+            self._expires_at = time.monotonic() + ttl
+
+    def _walk(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._walking = False
+
+    def _read_shared(self):
+        # (ids, seconds until they're stale) from the shared file, or (None, None) when this
+        # worker should walk users.list itself. the others wait for worker 0, unless the file
+        # is so old that worker 0 must be stuck
+        if not self.shared_path:
+            return None, None
+        try:
+            age = time.time() - os.path.getmtime(self.shared_path)
+            with open(self.shared_path, encoding="utf-8") as f:
+                ids = frozenset(json.load(f))
+        except (OSError, ValueError):
+            ids, age = None, None
+        if ids is not None and age < self.ttl:
+            return ids, self.ttl - age
+        if self.walks or (age is not None and age > 2 * self.ttl):
+            return None, None
+        raise RuntimeError("waiting for worker 0 to walk users.list")
+
+    def _write_shared(self, ids):
+        if not self.shared_path:
+            return
+        # write and rename, so nobody reads half a file
+        tmp_path = f"{self.shared_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(ids), f)
+        os.replace(tmp_path, self.shared_path)
+
+    def _fetch(self):
+        ids = set(UNKNOWN_BOTS)
+        cursor = None
+        while True:
+            response = self.client.users_list(limit=USERS_PAGE_SIZE, cursor=cursor) if cursor else self.client.users_list(limit=USERS_PAGE_SIZE)
+            ids.update(user["id"] for user in response["members"] if user.get("is_bot") or user.get("deleted"))
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return frozenset(ids)
+
+    def note(self, user):
+        # a user object from a team_join event
+        with self._lock:
+            if self._ids is None:
+                return
+            if user.get("is_bot") or user.get("deleted"):
+                self._ids = self._ids | {user["id"]}
+            else:
+                self._ids = self._ids - {user["id"]}
+
+    def start(self):
+        # walk it once in the background, so the first team kudos already has it
+        self.ids()
+
+
+def make_bot_directory(token, base_url):
+    # users.list is tier 2 and a big workspace takes a lot of pages, so the walk gets its own
+    # client that waits out 429s instead of giving up halfway
+    client = TimedWebClient(token=token, base_url=base_url, retry_handlers=default_retry_handlers() + [RateLimitErrorRetryHandler(max_retry_count=5)])
+    return BotDirectory(client, shared_path=BOT_LIST_PATH, walks=WORKER_ID == 0)
+
+
+class MembershipIndex:
+    # who's in each user group and channel, so thanking a team doesn't page through slack
+    # every time. entries expire after GROUP_CACHE_SECONDS, and the membership change events
+    # drop them sooner (see invalidate). one fetch per target at a time, whoever else asks
+    # for it meanwhile waits for that answer instead of fetching it again.
+    #
+    # only people are kept, bots and deactivated accounts are left out (see BotDirectory).
+    # paging stops once a target has more than max_members people, whoever asks is told
+    # it's too big without waiting for the rest of a huge channel.
+
+    def __init__(self, client, ttl=GROUP_CACHE_SECONDS, max_size=GROUP_CACHE_SIZE, max_members=KUDOS_MAX_GROUP_SIZE, bots=None):
+        self.client = client
+        self.bots = bots or BotDirectory(client)
+        self.max_members = max_members
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        # called with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        members, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return members
+
+    def members(self, kind, target_id):
+        key = (kind, target_id)
+        with self._lock:
+            members = self._cached(key)
+            if members is not None:
+                lookups.inc(kind=kind, result="hit")
+                return members
+            fetch_lock = self._fetching.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            with self._lock:
+                members = self._cached(key)
+                if members is not None:
+                    lookups.inc(kind=kind, result="hit")
+                    return members
+            lookups.inc(kind=kind, result="miss")
+            members = self._fetch(kind, target_id)
+            with self._lock:
+                self._entries[key] = (members, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                self._fetching.pop(key, None)
+            return members
+
+    def _fetch(self, kind, target_id):
+        if kind == "subteam":
+            method, field, kwargs = self.client.usergroups_users_list, "users", {"usergroup": target_id}
+        else:
+            method, field, kwargs = self.client.conversations_members, "members", {"channel": target_id, "limit": PAGE_SIZE}
+        bots = self.bots.ids()
+        members = []
+        cursor = None
+        while True:
+            response = method(**kwargs, cursor=cursor) if cursor else method(**kwargs)
+            members.extend(user_id for user_id in response[field] if user_id not in bots)
+            if len(members) > self.max_members:
+                # too big either way, one past the cap is enough to say so
+                return tuple(members[:self.max_members + 1])
+            # usergroups.users.list answers in one go, conversations.members pages with a cursor
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return tuple(members)
+
+    def resolve(self, targets):
+        # everyone in all of the targets, each person once
+        members = {}
+        for kind, target_id in targets:
+            members.update(dict.fromkeys(self.members(kind, target_id)))
+        return list(members)
+
+    def includes(self, targets, user_id):
+        # whether user_id is in every one of the targets. you can only thank a team you're in,
+        # so nobody can make the bot DM a channel they aren't part of
+        return all(user_id in self.members(kind, target_id) for kind, target_id in targets)
+
+    def invalidate(self, kind, target_id):
+        with self._lock:
+            self._entries.pop((kind, target_id), None)
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+import time
+from metrics import registry, Counter
+
+IDEMPOTENCY_PATH = os.getenv("KUDOS_IDEMPOTENCY_PATH", "kudos_idempotency.db")
+IDEMPOTENCY_TTL = float(os.getenv("KUDOS_IDEMPOTENCY_TTL", "86400"))
+
+duplicates = registry.register(Counter(
+    "kudos_idempotency_duplicates_total", "Slack requests skipped because another worker or an earlier try already handled them."))
+
+
+def request_key(body, view=None):
+    # what makes a slack request unique. a retried envelope carries the same trigger_id, or for
+    # modals the same view id + hash (the hash changes when we update the view after an error)
+    body = body or {}
+    view = view or body.get("view") or {}
+    if view.get("id"):
+        return f"view:{view['id']}:{view.get('hash', '')}"
+    if body.get("trigger_id"):
+        return f"trigger:{body['trigger_id']}"
+    if body.get("event_id"):
+        return f"event:{body['event_id']}"
+    if body.get("envelope_id"):
+        return f"envelope:{body['envelope_id']}"
+    return None
+
+
+class IdempotencyStore:
+    # claims live in a local sqlite file, so every worker process on the box sees them.
+    # the first claim() for a key wins, everybody after that gets False.
+
+    def __init__(self, path=IDEMPOTENCY_PATH, ttl=IDEMPOTENCY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, claimed_at REAL NOT NULL)")
+        return db
+
+    def claim(self, key):
+        if key is None:
+            return True
+        now = time.time()
+        with self._lock:
+            if self._db is None:
+                self._db = self._connect()
+            try:
+                if now - self._last_purge > 60:
+                    self._last_purge = now
+                    self._db.execute("DELETE FROM claims WHERE claimed_at < ?", (now - self.ttl,))
+                claimed = self._db.execute("INSERT OR IGNORE INTO claims (key, claimed_at) VALUES (?, ?)", (key, now)).rowcount == 1
+            except sqlite3.Error as e:
+                # better a rare double kudos than dropping one because the file is locked
+                print(f"Idempotency check failed, letting it through {e}")
+                return True
+        if not claimed:
+            duplicates.inc()
+            print(f"Skipping a request that was already handled ({key})")
+        return claimed
@@ -0,0 +1,233 @@
+from datetime import datetime, timezone
+from functools import partial
+from blocks import kudos_message_blocks, digest_blocks, digest_text
+from leaderboard import window_start
+from metrics import track
+from moderation import count_verdict, verdict_of, FLAGGED, UNAVAILABLE, DEGRADED_MODE
+
+# the supabase, moderation and delivery logic main.py and async_main.py share. the two only
+# differ in whether a call is awaited, so every check that talks to supabase or the moderation
+# api is a generator: it yields the call it needs (a function with no arguments) and gets the
+# answer sent back in, or the exception thrown in. run_sync and run_async make the calls.
+#
+#   def fetch_gate_state(sender_id, recipient_id=None):
+#       return run_sync(core.fetch_gate_state(sender_id, recipient_id))
+
+
+def run_sync(steps):
+    try:
+        call = next(steps)
+        while True:
+            try:
+                result = call()
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_async(steps):
+    try:
+        call = next(steps)
+        while True:
+            try:
+                result = await call()
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+class KudosCore:
+
+    def __init__(self, supabase, user_state, last_known, gate_breaker, local_moderator, verdict_cache, moderation_batcher, kudos_writer, leaderboard, delivery, digest=None):
+        self.supabase = supabase
+        self.user_state = user_state
+        self.last_known = last_known
+        self.gate_breaker = gate_breaker
+        self.local_moderator = local_moderator
+        self.verdict_cache = verdict_cache
+        self.moderation_batcher = moderation_batcher
+        self.kudos_writer = kudos_writer
+        self.leaderboard = leaderboard
+        self.delivery = delivery
+        # set once the DigestBuffer exists, it needs send_digest first
+        self.digest = digest
+
+    def fetch_gate_state(self, sender_id, recipient_id=None):
+        # opt-out and agreement state for a sender (and recipient) in one go. comes straight from
+        # the replica once it's loaded, otherwise it's one kudos_gate_state rpc, see migrations/
+        state = self.user_state.lookup(sender_id, recipient_id)
+        if state is not None:
+            return state
+        if self.gate_breaker.allow():
+            try:
+                with track("supabase", "rpc.kudos_gate_state"):
+                    response = yield self.supabase.rpc("kudos_gate_state", {"sender": sender_id, "recipient": recipient_id}).execute
+                self.gate_breaker.success()
+                self.last_known.remember(sender_id, recipient_id, response.data)
+                return response.data
+            except Exception as e:
+                self.gate_breaker.failure()
+                print(f"Unable to fetch gate state. {e}")
+        return self.last_known.state(sender_id, recipient_id)
+
+    def gate_blocker(self, sender_id, recipient_id):
+        state = yield from self.fetch_gate_state(sender_id, recipient_id)
+        if state is None:
+            # supabase is down and we've never seen this sender, see LastKnownState.state
+            return "gate_unavailable"
+        if state["sender_opted_out"]:
+            return "sender_opted_out"
+        if not state["sender_agreed"]:
+            return "no_agreement"
+        if state["recipient_opted_out"]:
+            return "recipient_opted_out"
+        return None
+
+    def check_if_opt_out(self, user_id):
+        # unknown during an outage counts as not opted out, the command's own supabase call fails anyway
+        state = yield from self.fetch_gate_state(user_id)
+        return state is not None and state["sender_opted_out"]
+
+    def fetch_opted_out(self, user_ids, fallback=True):
+        # which of these users opted out, from the replica or one in_ query on kudos_opt_out.
+        # without the fallback it's None when supabase can't be asked, instead of the last known answers
+        opted_out = self.user_state.opted_out_among(user_ids)
+        if opted_out is not None:
+            return opted_out
+        if self.gate_breaker.allow():
+            try:
+                with track("supabase", "kudos_opt_out"):
+                    response = yield self.supabase.table("kudos_opt_out").select("user_id").in_("user_id", list(user_ids)).execute
+                self.gate_breaker.success()
+                opted_out = {row["user_id"] for row in response.data}
+                self.last_known.remember_opted_out(user_ids, opted_out)
+                return opted_out
+            except Exception as e:
+                self.gate_breaker.failure()
+                print(f"Unable to check opt-outs. {e}")
+        return self.last_known.opted_out_among(user_ids) if fallback else None
+
+    def fetch_kudos_stats(self, user_id):
+        # this week / this month / all time, summed from the daily rollups in one rpc, see migrations/003_kudos_rollups.sql
+        now = datetime.now(timezone.utc)
+        try:
+            with track("supabase", "rpc.kudos_user_stats"):
+                response = yield self.supabase.rpc("kudos_user_stats", {
+                    "target": user_id,
+                    "week_start": window_start("week", now).date().isoformat(),
+                    "month_start": window_start("month", now).date().isoformat(),
+                }).execute
+            return response.data
+        except Exception as e:
+            print(f"Error when fetching stats! {e}")
+            return None
+
+    def save_usr_agreement(self, user_id):
+        try:
+            with track("supabase", "user_agreements"):
+                yield self.supabase.table("user_agreements").insert({"user_id": user_id}).execute
+            self.user_state.mark_agreed(user_id)
+            self.last_known.mark(user_id, agreed=True)
+            return True
+        except Exception as e:
+            print(f"Unable to save : {e}")
+
+    def if_txt_flagged(self, text):
+        if not text:
+            return False
+
+        # obvious cases never leave the process, see LocalModerator
+        local = self.local_moderator.check(text)
+        if local is not None:
+            return local
+
+        cached = self.verdict_cache.get(text)
+        if cached is not None:
+            count_verdict("cache", verdict_of(cached))
+            return cached
+
+        # gives up in time for the handler to answer, see ModerationBatcher
+        verdict = yield partial(self.moderation_batcher.check, text)
+        count_verdict("remote", verdict)
+        if verdict == UNAVAILABLE:
+            # not the same as flagged, the user just gets told to try again (or it goes through unchecked)
+            return "moderation_unavailable" if DEGRADED_MODE == "block" else False
+        self.verdict_cache.put(text, verdict == FLAGGED)
+        return verdict == FLAGGED
+
+    def add_to_opt_out_table(self, user_id):
+        try:
+            with track("supabase", "kudos_opt_out"):
+                yield self.supabase.table("kudos_opt_out").insert({"user_id": user_id}).execute
+
+            with track("supabase", "user_agreements"):
+                yield self.supabase.table("user_agreements").delete().eq("user_id", user_id).execute
+            self.user_state.mark_opted_out(user_id)
+            self.last_known.mark(user_id, opted_out=True, agreed=False)
+        except Exception as e:
+            print(f"Unable to add to opt-out list: {e}")
+            return False
+
+        # kudos already waiting for their digest don't go out either
+        try:
+            self.digest.drop(user_id)
+        except Exception as e:
+            print(f"Unable to drop the kudos digest for {user_id} {e}")
+        return True
+
+    def remove_from_opt_out_table(self, user_id):
+        try:
+            with track("supabase", "kudos_opt_out"):
+                yield self.supabase.table("kudos_opt_out").delete().eq("user_id", user_id).execute
+            self.user_state.mark_opted_in(user_id)
+            self.last_known.mark(user_id, opted_out=False)
+            return True
+        except Exception as e:
+            print(f"Unable to remove from opt-out list: {e}")
+            return False
+
+    # the rest never waits on anything, both runtimes call these directly
+
+    def kudos_data_collector(self, sender_id, recipient_ids, reason):
+        # its harmless i swear :3c it just collects the recipient's and sender's slack id and the kudos reason
+        # rows are batched and inserted by kudos_writer in the background, see kudos_writer.py
+        self.kudos_writer.add_many(sender_id, recipient_ids, reason)
+        for recipient_id in recipient_ids:
+            self.leaderboard.record(sender_id, recipient_id)
+
+    def send_kudos_dm(self, sender_id, recipient_id, reason):
+        # goes through the delivery queue so a burst of kudos doesn't trip slack's rate limits.
+        # if it never gets through, the sender gets told instead of the error vanishing
+        if self.digest.wants(recipient_id):
+            try:
+                self.digest.add(sender_id, recipient_id, reason)
+                return
+            except Exception as e:
+                print(f"Unable to buffer a kudos for the digest, sending it now {e}")
+
+        def tell_sender(error):
+            self.delivery.enqueue(
+                "chat_postMessage",
+                channel=sender_id,
+                text=f"Oops! I wasn't able to deliver your kudos to <@{recipient_id}>. :neocat_sad_reach: ({error})"
+            )
+
+        self.delivery.enqueue(
+            "chat_postMessage",
+            on_failure=tell_sender,
+            channel=recipient_id,
+            text=f":neocat_heart: You recieved a kudos from <@{sender_id}> Here is the reason why! {reason}",
+            blocks=kudos_message_blocks(sender_id, reason)
+        )
+
+    def send_digest(self, recipient_id, kudos):
+        # add_to_opt_out_table drops their digest, this catches opt-outs that came in from elsewhere
+        if self.user_state.is_opted_out(recipient_id):
+            return
+        self.delivery.enqueue("chat_postMessage", channel=recipient_id, text=digest_text(kudos), blocks=digest_blocks(kudos))
@@ -0,0 +1,100 @@
+import re
+from blocks import get_rules_block
+from groups import find_targets, strip_targets, KUDOS_MAX_GROUP_SIZE
+from preflight import TIMED_OUT
+from delivery import DELIVERY_POST_RATE
+
+# parsing and wording shared by main.py and async_main.py, so the two runtimes can't drift apart
+
+MENTION_PATTERN = re.compile(r"<@([A-Za-z0-9]+)\|[^>]+>")
+
+DEFAULT_REASON = "being an awesome person!"
+
+
+def parse_give_kudos(text):
+    # "/give-kudos @a @b #team thanks!" -> (["A", "B"], [("channel", "C...")], "thanks!")
+    # someone mentioned twice still gets one kudos
+    mentions = list(dict.fromkeys(MENTION_PATTERN.findall(text)))
+    targets = find_targets(text)
+    reason = re.sub(r" {2,}", " ", MENTION_PATTERN.sub("", strip_targets(text))).strip()
+    return mentions, targets, reason or DEFAULT_REASON
+
+
+def leaderboard_window(text):
+    window = (text or "").strip().lower()
+    window = {"all-time": "all", "alltime": "all"}.get(window, window)
+    return window if window in ("week", "month", "all") else "week"
+
+
+def kudos_sent_text(recipient_ids, skipped, targets=(), skipped_members=0):
+    # with a user group or channel in there, name those instead of a wall of mentions
+    if targets:
+        text = f"Your kudos to {', '.join(targets)} ({len(recipient_ids)} people) is on its way! :neocat_heart:"
+    else:
+        text = f"Your kudos to {', '.join(f'<@{user_id}>' for user_id in recipient_ids)} is on its way! :neocat_heart:"
+    if skipped:
+        text += "\nSkipped: " + ", ".join(f"<@{user_id}> ({why})" for user_id, why in skipped.items())
+    if skipped_members:
+        text += f"\nSkipped {skipped_members} {'member' if skipped_members == 1 else 'members'} who opted out"
+    # the delivery queue paces DMs, so say when a big team won't have them all right away
+    seconds = round(len(recipient_ids) / DELIVERY_POST_RATE)
+    if seconds >= 5:
+        text += f"\nThe DMs go out over about {seconds} seconds"
+    return text
+
+
+def give_kudos_blocked_reply(blocked, resolved):
+    # what /give-kudos answers when a preflight check blocked it, as respond() kwargs
+    if blocked == "sender_opted_out":
+        return {"text": "You have opted out from this kudos system. You are unable to send kudos. To opt-in again, run /opt-in. :neocat_baa:", "replace_original": False}
+    if blocked == "no_agreement":
+        return {"text": "It looks like you haven't agreed to our guidelines, please read it first!", "blocks": get_rules_block()}
+    if blocked == "group_unavailable":
+        return {"text": "Oops! I couldn't see who's in that user group or channel. If it's a private channel, add me to it first. :neocat_sad_reach:"}
+    if blocked == "group_empty":
+        return {"text": "There's nobody in there to give kudos to! :neocat_blank:"}
+    if blocked == "group_too_big":
+        return {"text": f"You can give kudos to up to {KUDOS_MAX_GROUP_SIZE} people at once. :neocat_sad_reach:"}
+    if blocked == "not_a_member":
+        return {"text": "You can only give kudos to a user group or channel you're in. :neocat_sad_reach:"}
+    if blocked == "recipient_opted_out":
+        if len(resolved) == 1:
+            return {"text": f"Oops! <@{resolved[0]}> has opted out. You cannot send kudos to this user. :neocat_sad_reach:"}
+        return {"text": "Oops! Everyone you mentioned has opted out. You cannot send kudos to them. :neocat_sad_reach:"}
+    if blocked == "flagged":
+        return {"text": ":neocat_0_0: This message has been flagged by our moderation system. Please rewrite your message!"}
+    if blocked == "moderation_unavailable":
+        return {"text": "Oops! Our moderation system isn't answering right now, so your kudos wasn't sent. Please try again in a bit. :neocat_sad_reach:"}
+    if blocked == "gate_unavailable":
+        return {"text": "Oops! I can't reach the kudos database to check your account right now, so your kudos wasn't sent. Please try again in a bit. :neocat_sad_reach:"}
+    if blocked == TIMED_OUT:
+        return {"text": "Oops! Checking your kudos took too long. Please try again in a bit. :neocat_sad_reach:"}
+    if blocked:
+        # CHECK_FAILED, or anything else nobody wrote a message for. never let it through
+        return {"text": "Oops! I couldn't check your kudos right now, so it wasn't sent. Please try again in a bit. :neocat_sad_reach:"}
+    return None
+
+
+def view_blocked_text(blocked, recipient_id):
+    # the same for the kudos modals, shown as the error under the reason field
+    if blocked == "no_agreement":
+        return "You haven't agreed to our guidelines! To use this service, run the /opt-in command."
+    if blocked == "sender_opted_out":
+        return "You have opted out and unable to send kudos. To opt-in, run the /opt-in command."
+    if blocked == "flagged":
+        return "This message has been flagged by our moderation system. Please rewrite your message."
+    if blocked == "moderation_unavailable":
+        return "Our moderation system isn't answering right now. Please try again in a bit."
+    if blocked == "recipient_opted_out":
+        return f"Oops! <@{recipient_id}> has opted out. You cannot send kudos to this user. :neocat_sad_reach:"
+    if blocked == "gate_unavailable":
+        return "I can't reach the kudos database to check your account right now. Please try again in a bit."
+    if blocked == TIMED_OUT:
+        return "Checking your kudos took too long. Please try again in a bit."
+    if blocked:
+        return "I couldn't check your kudos right now, so it wasn't sent. Please try again in a bit."
+    return None
+
+
+def erased_text(user_id, deleted):
+    return f"Erased <@{user_id}>'s data ({', '.join(f'{count} from {table}' for table, count in deleted.items())}). If they opted out, that's kept so they stay out. :neocat_blank:"
@@ -0,0 +1,213 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from postgrest import ReturnMethod
+from metrics import track
+
+BATCH_SIZE = int(os.getenv("KUDOS_BATCH_SIZE", "50"))
+FLUSH_MS = int(os.getenv("KUDOS_FLUSH_MS", "250"))
+SPILL_PATH = os.getenv("KUDOS_SPILL_PATH", "kudos_spill.db")
+REPLAY_SECONDS = float(os.getenv("KUDOS_REPLAY_SECONDS", "5"))
+
+
+class KudosWriter:
+    # write-behind queue for collect_kudos. handlers drop rows in with add() and a
+    # background thread bulk inserts them. if supabase is down the rows go into a
+    # local sqlite file and get replayed in order once it comes back.
+    #
+    # an insert that times out may still have been committed, so every row carries a
+    # client_key and goes in with ON CONFLICT (client_key) DO NOTHING. replaying a batch
+    # that already landed is a no-op, see migrations/004_collect_kudos_client_key.sql
+
+    def __init__(self, supabase, batch_size=BATCH_SIZE, flush_ms=FLUSH_MS, spill_path=SPILL_PATH, replay_seconds=REPLAY_SECONDS):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.spill_path = spill_path
+        self.replay_seconds = replay_seconds
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._db = None
+        self._spilled = False
+        self._last_replay = 0.0
+        self._in_flight = 0
+        # held around every flush, so forget() can wait out an insert that's already going
+        self._flush_lock = threading.Lock()
+        self._forgotten = set()
+
+    def add(self, sender_id, recipient_id, reason):
+        self.add_many(sender_id, [recipient_id], reason)
+
+    def add_many(self, sender_id, recipient_ids, reason):
+        # one kudos to several people. the rows go in back to back, so they end up in the same bulk insert
+        self.start()
+        # stamp it now so a replayed row keeps the time the kudos was actually sent
+        created_at = datetime.now(timezone.utc).isoformat()
+        for recipient_id in recipient_ids:
+            self._queue.put({
+                "sender_id": sender_id,
+                "recipient_id": recipient_id,
+                "reason": reason,
+                "created_at": created_at,
+                "client_key": str(uuid.uuid4()),
+            })
+
+    def start(self):
+        if self._thread:
+            return
+        with self._start_lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="kudos-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+    def pending(self):
+        # rows not in supabase yet, spilled ones not included
+        return self._queue.qsize() + self._in_flight
+
+    def forget(self, user_id):
+        # for erasing someone: drop the kudos they sent or received that aren't in supabase
+        # yet, from the queue and the spill, and wait for a batch that's already being
+        # inserted so nothing of theirs lands after the delete. returns how many were dropped
+        with self._flush_lock:
+            # the writer may be holding some of theirs in the batch it's collecting
+            self._forgotten.add(user_id)
+            with self._queue.mutex:
+                kept = [row for row in self._queue.queue if row is None or user_id not in (row["sender_id"], row["recipient_id"])]
+                dropped = len(self._queue.queue) - len(kept)
+                self._queue.queue.clear()
+                self._queue.queue.extend(kept)
+            return dropped + forget_spilled(self.spill_path, user_id)
+
+    def _open_spill(self):
+        self._db = sqlite3.connect(self.spill_path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS spill (seq INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL)")
+        self._db.commit()
+        self._spilled = self._db.execute("SELECT 1 FROM spill LIMIT 1").fetchone() is not None
+
+    def _run(self):
+        self._open_spill()
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                first = self._queue.get(timeout=self.replay_seconds if self._spilled else None)
+            except queue.Empty:
+                first = None
+                if not self._spilled:
+                    continue
+            else:
+                if first is None:
+                    stopping = True
+                else:
+                    batch.append(first)
+                    self._in_flight = 1
+
+            deadline = time.monotonic() + self.flush_seconds
+            while batch and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+                self._in_flight = len(batch)
+
+            with self._flush_lock:
+                if self._forgotten:
+                    # anything of theirs in this batch was taken from the queue before forget() ran
+                    batch = [row for row in batch if row["sender_id"] not in self._forgotten and row["recipient_id"] not in self._forgotten]
+                    self._forgotten.clear()
+                self._flush(batch)
+            self._in_flight = 0
+
+        self._db.close()
+
+    def _flush(self, batch):
+        if self._spilled:
+            # older rows are still waiting in the spill, so these go behind them to keep the order
+            self._spill(batch)
+            if time.monotonic() - self._last_replay >= self.replay_seconds or not batch:
+                self._replay()
+            return
+
+        if not batch:
+            return
+
+        try:
+            self._insert(batch)
+            print(f"Capturing successful :3 ({len(batch)} kudos)")
+        except Exception as e:
+            print(f"failed to capture, spilling {len(batch)} kudos to {self.spill_path} :( {e}")
+            self._spill(batch)
+
+    def _insert(self, rows):
+        with track("supabase", "collect_kudos"):
+            (
+                self.supabase.table("collect_kudos")
+                .upsert(rows, on_conflict="client_key", ignore_duplicates=True, returning=ReturnMethod.minimal)
+                .execute()
+            )
+
+    def _spill(self, batch):
+        if not batch:
+            return
+        self._db.executemany("INSERT INTO spill (row) VALUES (?)", [(json.dumps(row),) for row in batch])
+        self._db.commit()
+        self._spilled = True
+
+    def _replay(self):
+        self._last_replay = time.monotonic()
+        while True:
+            rows = self._db.execute("SELECT seq, row FROM spill ORDER BY seq LIMIT ?", (self.batch_size,)).fetchall()
+            if not rows:
+                self._spilled = False
+                return
+            try:
+                self._insert([json.loads(row) for _, row in rows])
+            except Exception as e:
+                print(f"Still unable to replay spilled kudos {e}")
+                return
+            self._db.execute("DELETE FROM spill WHERE seq <= ?", (rows[-1][0],))
+            self._db.commit()
+            print(f"Replayed {len(rows)} spilled kudos :3")
+
+
+def forget_spilled(spill_path, user_id):
+    # drop someone's kudos from a spill file, returns how many. also used by user_data.py
+    # when it runs on the bot's machine
+    if not os.path.exists(spill_path):
+        return 0
+    db = sqlite3.connect(spill_path)
+    try:
+        with db:
+            cursor = db.execute(
+                "DELETE FROM spill WHERE json_extract(row, '$.sender_id') = ? OR json_extract(row, '$.recipient_id') = ?",
+                (user_id, user_id),
+            )
+        return cursor.rowcount
+    except sqlite3.OperationalError:
+        # no spill table, nothing was ever spilled there
+        return 0
+    finally:
+        db.close()
@@ -0,0 +1,174 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from heapq import nlargest
+from metrics import track
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+RECONCILE_SECONDS = float(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "600"))
+# fleet.py spreads its workers' reconciles over the interval instead of running them all at once
+RECONCILE_OFFSET = float(os.getenv("LEADERBOARD_RECONCILE_OFFSET", "0"))
+PAGE_SIZE = 1000
+
+WINDOWS = ("week", "month", "all")
+ROLES = ("recipient", "sender")
+
+
+def window_start(window, now):
+    # weeks start on monday, everything is in utc
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "week":
+        return midnight - timedelta(days=now.weekday())
+    if window == "month":
+        return midnight.replace(day=1)
+    return None
+
+
+class TopK:
+    # counts for everyone plus the k biggest, kept sorted. between reconciles counts only go up,
+    # so someone outside the top can only get in by passing the last entry.
+
+    def __init__(self, k, counts=None):
+        self.k = k
+        self.counts = dict(counts or {})
+        self.top = [[count, user] for user, count in nlargest(k, self.counts.items(), key=lambda item: item[1])]
+
+    def add(self, user, amount=1):
+        count = self.counts.get(user, 0) + amount
+        self.counts[user] = count
+        for entry in self.top:
+            if entry[1] == user:
+                entry[0] = count
+                break
+        else:
+            if len(self.top) >= self.k and count <= self.top[-1][0]:
+                return
+            self.top.append([count, user])
+        self.top.sort(key=lambda entry: -entry[0])
+        del self.top[self.k:]
+
+
+class Leaderboard:
+    # top receivers and senders for this week, this month and all time. kudos_data_collector feeds
+    # it as kudos go out, and every RECONCILE_SECONDS it's rebuilt from collect_kudos so restarts,
+    # other processes and deleted rows get picked up.
+
+    def __init__(self, supabase, size=LEADERBOARD_SIZE, reconcile_seconds=RECONCILE_SECONDS, reconcile_offset=RECONCILE_OFFSET):
+        self.supabase = supabase
+        self.size = size
+        # a few extra so hiding opted out users still leaves a full board
+        self.k = size * 2
+        self.reconcile_seconds = reconcile_seconds
+        self.reconcile_offset = reconcile_offset
+        self.ready = False
+        self._boards = {(window, role): TopK(self.k) for window in WINDOWS for role in ROLES}
+        self._starts = {}
+        self._log = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _roll(self, now):
+        # called with the lock held. a new week/month starts from zero. only ever forward, a
+        # late or replayed kudos with an older timestamp never takes a window back (and wipes it)
+        for window in ("week", "month"):
+            start = window_start(window, now)
+            if self._starts.get(window) is None or start > self._starts[window]:
+                self._starts[window] = start
+                for role in ROLES:
+                    self._boards[(window, role)] = TopK(self.k)
+
+    def _apply(self, sender_id, recipient_id, when):
+        # windows move with the clock, and a kudos from before a window started isn't counted in it
+        self._roll(datetime.now(timezone.utc))
+        for window in WINDOWS:
+            if window != "all" and when < self._starts[window]:
+                continue
+            self._boards[(window, "sender")].add(sender_id)
+            self._boards[(window, "recipient")].add(recipient_id)
+
+    def record(self, sender_id, recipient_id, when=None):
+        when = when or datetime.now(timezone.utc)
+        with self._lock:
+            self._apply(sender_id, recipient_id, when)
+            if self._log is not None:
+                self._log.append((sender_id, recipient_id, when))
+
+    def top(self, window, skip=(), among=None):
+        # {"recipient": [(user_id, count), ...], "sender": [...]}, straight from memory. with among,
+        # only those users can show up (whoever got onto the board after they were checked can't)
+        with self._lock:
+            self._roll(datetime.now(timezone.utc))
+            boards = {role: list(self._boards[(window, role)].top) for role in ROLES}
+        return {
+            role: [(user, count) for count, user in entries if user not in skip and (among is None or user in among)][:self.size]
+            for role, entries in boards.items()
+        }
+
+    def users(self, window):
+        # everyone who could show up on the window's boards, opted out or not
+        with self._lock:
+            return {user for role in ROLES for _, user in self._boards[(window, role)].top}
+
+    def _fetch(self, since):
+        counts = {role: {} for role in ROLES}
+        start = 0
+        while True:
+            with track("supabase", "rpc.kudos_leaderboard_counts"):
+                response = (
+                    self.supabase.rpc("kudos_leaderboard_counts", {"since": since.isoformat() if since else None})
+                    .order("role").order("user_id")
+                    .range(start, start + PAGE_SIZE - 1)
+                    .execute()
+                )
+            for row in response.data:
+                counts[row["role"]][row["user_id"]] = row["kudos"]
+            if len(response.data) < PAGE_SIZE:
+                return counts
+            start += PAGE_SIZE
+
+    def reconcile(self):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            # kudos recorded while we read get replayed on top. one that was still in the
+            # write-behind queue when the read started is missed until the next pass
+            self._log = []
+        try:
+            fetched = {window: self._fetch(window_start(window, now)) for window in WINDOWS}
+        except Exception:
+            with self._lock:
+                self._log = None
+            raise
+
+        with self._lock:
+            self._boards = {
+                (window, role): TopK(self.k, counts[role])
+                for window, counts in fetched.items()
+                for role in ROLES
+            }
+            self._starts = {window: window_start(window, now) for window in ("week", "month")}
+            for sender_id, recipient_id, when in self._log:
+                self._apply(sender_id, recipient_id, when)
+            self._log = None
+            self.ready = True
+
+    def _run(self):
+        if self.ready and self._stop.wait(self.reconcile_offset):
+            return
+        # retry sooner while the first load hasn't worked yet
+        while not self._stop.wait(self.reconcile_seconds if self.ready else min(30, self.reconcile_seconds)):
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"Leaderboard reconcile failed {e}")
+
+    def start(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            print(f"Unable to load the leaderboard, it will retry in the background. {e}")
+        self._thread = threading.Thread(target=self._run, name="leaderboard", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,203 +1,117 @@
 import os
-import re
+import signal
+import sys
+import tempfile
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from dotenv import load_dotenv
 from openai import OpenAI
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from user_state import UserStateReplica, LastKnownState
+from breaker import CircuitBreaker
+from moderation import make_verdict_cache, make_local_moderator, ModerationBatcher
+from kudos_writer import KudosWriter
+from delivery import DeliveryScheduler
+from digest import DigestBuffer, describe_interval
+from groups import MembershipIndex, make_bot_directory, format_target, KUDOS_MAX_GROUP_SIZE
+from leaderboard import Leaderboard
+from metrics import timed_handler, register_cache, start_metrics_server, TimedWebClient
+from tracing import traced, bolt_middleware
+from preflight import run_preflight
+from idempotency import IdempotencyStore, request_key
+from user_data import is_admin, parse_command, export_to_file, erase_user
+from transport import make_http_client, start_warmer
+from blocks import get_rules_block, help_blocks, stat_blocks, kudos_modal, return_kudos_modal, modal_notice, leaderboard_blocks
+from kudos_core import KudosCore, run_sync
+from kudos_text import parse_give_kudos, leaderboard_window, kudos_sent_text, give_kudos_blocked_reply, view_blocked_text, erased_text
 
 load_dotenv()
 
+if __name__ == "__main__":
+    # turn SIGTERM (fleet.py, docker, systemd) into a normal exit so the kudos writer flushes
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    # async_main.py builds its own app, clients and threads, so hand over before any of ours exist
+    if os.getenv("KUDOS_RUNTIME", "sync") == "async":
+        import async_main
+        async_main.run()
+        sys.exit(0)
+
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
 MODERATION_URL = os.getenv("MODERATION_URL")
 MODERATION_KEY = os.getenv("MODERATION_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+KUDOS_MAX_RECIPIENTS = int(os.getenv("KUDOS_MAX_RECIPIENTS", "20"))
 
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# supabase and moderation share one tuned keep-alive pool, see transport.py
+http_client = make_http_client()
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http_client))
 
-app=App(token=SLACK_BOT_TOKEN)
+app=App(client=TimedWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL))
+# one trace per request, see tracing.py
+app.use(bolt_middleware)
 
 mod_client=OpenAI(
     base_url=MODERATION_URL,
-    api_key=MODERATION_KEY
+    api_key=MODERATION_KEY,
+    http_client=http_client
 )
 
+user_state = UserStateReplica(supabase)
+local_moderator = make_local_moderator()
+verdict_cache = make_verdict_cache()
+# concurrent checks share moderation calls, see moderation.py
+moderation_batcher = ModerationBatcher(mod_client)
+register_cache("moderation", lambda: (verdict_cache.hits, verdict_cache.misses))
+register_cache("gate_state", lambda: (user_state.hits, user_state.misses))
+kudos_writer = KudosWriter(supabase)
+leaderboard = Leaderboard(supabase)
+# when supabase is down the gate answers from the last values it saw, see breaker.py
+last_known = LastKnownState()
+gate_breaker = CircuitBreaker("supabase_gate", lambda: supabase.table("kudos_opt_out").select("user_id").limit(1).execute())
+# shared by every worker process, see fleet.py
+idempotency = IdempotencyStore()
+delivery = DeliveryScheduler(app.client)
+
+
+# the gate, moderation, opt-out and delivery logic is shared with async_main.py, see kudos_core.py
+core = KudosCore(supabase, user_state, last_known, gate_breaker, local_moderator, verdict_cache, moderation_batcher, kudos_writer, leaderboard, delivery)
+# people who turned on /kudos-digest get their kudos in one DM per interval, see digest.py
+digest = DigestBuffer(core.send_digest)
+core.digest = digest
+# who's in each user group and channel, for kudos to a whole team, see groups.py
+membership = MembershipIndex(app.client, bots=make_bot_directory(SLACK_BOT_TOKEN, SLACK_API_URL))
+
+
+def gate_blocker(sender_id, recipient_id):
+    return run_sync(core.gate_blocker(sender_id, recipient_id))
 
-def check_usr_agreement(user_id):
-    try:
-        response = supabase.table("user_agreements").select("user_id").eq("user_id", user_id).execute()
-        return len(response.data) > 0
-    except Exception as e:
-        print(f"Supabase err {e}")
-        return False
+def check_if_opt_out(user_id):
+    return run_sync(core.check_if_opt_out(user_id))
 
-def fetch_kudos_stats(user_id):
-    try:
-        sent_response = supabase.table("collect_kudos").select("id").eq("sender_id", user_id).execute()
-        sent_count = len(sent_response.data)
-    
-        recieved_response = supabase.table("collect_kudos").select("id").eq("recipient_id", user_id).execute()
-        recieved_count = len(recieved_response.data)
+def fetch_opted_out(user_ids, fallback=True):
+    return run_sync(core.fetch_opted_out(user_ids, fallback))
 
-        return sent_count, recieved_count
-    except Exception as e:
-        print(f"Error when fetching stats!")
-        return 0,0
-    
+def fetch_kudos_stats(user_id):
+    return run_sync(core.fetch_kudos_stats(user_id))
 
 def save_usr_agreement(user_id):
-    try:
-        supabase.table("user_agreements").insert({"user_id": user_id}).execute()
-        return True
-    except Exception as e:
-        print(f"Unable to save : {e}")
-
-def get_rules_block():
-    return[
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": ":neocat_book: *Community Guidelines*"
-            }
-        },
-        {
-            "type": "divider"
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "Before you send your first kudos to your buddy, please follow these rules and reminders!",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "1. Be respectful!",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "2. No inappropriate content. Moderation is in place.",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "3. Kudos's messages will be logged for safety.",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "4. Please follow the <https://hack.af/coc|Code of Conduct> when sending kudos!"
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "Note on our collection policy: Your Slack ID and timestamp will be logged when you agreed to these guidelines. This information will be saved into a Supabase table. We will also collect your Slack ID, the recipient's Slack ID and the kudos reason into a seperate Supabase table. We use this information for safety purposes. If any Fire Department member asks for this information, we'll gladly hand it over to them. If you would like your data to be removed, please DM @areallyawesomeusername",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "Please note that the moderation system is powered by OpenAI models. It not might be accurate and some harmful messages might slip through. If you encounter any harmful messages, please file a Shroud report or contact a FD member.",
-                "emoji": True
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "plain_text",
-                "text": "By agreeing to these guidelines, you allow us to collect the information listed in our collection policy and will follow the guidelines above.",
-                "emoji": True
-            }
-        },
-        {
-            "type": "actions",
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "I agree to the above.",
-                        "emoji": True
-                    },
-                    "value": "agree_button",
-                    "action_id": "button-action"
-                }
-            ]
-        }
-    ]
-
-
+    return run_sync(core.save_usr_agreement(user_id))
 
 def if_txt_flagged(text):
+    return run_sync(core.if_txt_flagged(text))
 
-    if not text:
-        return False
-    
-    try:
-        response = mod_client.moderations.create(input=text)
-        return response.results[0].flagged
-    except Exception as e:
-        print(f"Moderation API error {e}")
-        return True
-    
 def add_to_opt_out_table(user_id):
-    try:
-        supabase.table("kudos_opt_out").insert({"user_id": user_id}).execute()
-
-        supabase.table("user_agreements").delete().eq("user_id", user_id).execute()
-        return True
-    except Exception as e:
-        print(f"Unable to add to opt-out list: {e}")
-        return False
-    
+    return run_sync(core.add_to_opt_out_table(user_id))
 
 def remove_from_opt_out_table(user_id):
-    try:
-        supabase.table("kudos_opt_out").delete().eq("user_id", user_id).execute()
-        return True
-    except Exception as e:
-        print(f"Unable to remove from opt-out list: {e}")
-        return False
-
-def check_if_opt_out(user_id):
-    try:
-        response = supabase.table("kudos_opt_out").select("user_id").eq("user_id", user_id).execute()
-        return len(response.data) > 0
-    except Exception as e:
-        print(f"Unable to check if user is opt-out. {e}")
+    return run_sync(core.remove_from_opt_out_table(user_id))
 
-def kudos_data_collector(sender_id, recipient_id, reason):
-# its harmless i swear :3c it just collects the recipient's and sender's slack id and the kudos reason
-    try:
-        supabase.table("collect_kudos").insert({
-            "sender_id": sender_id,
-            "recipient_id": recipient_id,
-            "reason": reason
-            }).execute()
-        print("Capturing successful :3")
-    except Exception as e:
-        print(f"failed to capture :( {e}")
+kudos_data_collector = core.kudos_data_collector
+send_kudos_dm = core.send_kudos_dm
 
 @app.action("button-action")
 def agreement_handler(ack, respond, body):
@@ -244,260 +158,199 @@ def opt_in_cmd(ack, respond, command):
 def help_cmd(ack, respond):
     ack()
 
-    help_blocks = [
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "KudosGiver Help :neocat_book: ",
-				"emoji": True
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "/give-kudos @User Reason",
-				"emoji": True
-			}
-		},
-		{
-			"type": "context",
-			"elements": [
-				{
-					"type": "plain_text",
-					"text": "Give kudos to a friend!",
-					"emoji": True
-				}
-			]
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "/opt-out",
-				"emoji": True
-			}
-		},
-		{
-			"type": "context",
-			"elements": [
-				{
-					"type": "plain_text",
-					"text": "Opt-out of the kudos system. :neocat_sad:",
-					"emoji": True
-				}
-			]
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "/opt-in",
-				"emoji": True
-			}
-		},
-		{
-			"type": "context",
-			"elements": [
-				{
-					"type": "plain_text",
-					"text": "Opt-in of the kudos system.",
-					"emoji": True
-				}
-			]
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "/my-kudos",
-				"emoji": True
-			}
-		},
-		{
-			"type": "context",
-			"elements": [
-				{
-					"type": "plain_text",
-					"text": "Check how many kudos you recieved and sent!",
-					"emoji": True
-				}
-			]
-		}
-	]
-
-    respond(blocks=help_blocks)
+    respond(blocks=help_blocks())
 
     
-@app.command("/my-kudos")
-def kudos_cmd(ack, command, respond):
+@app.command("/kudos-leaderboard")
+@timed_handler("/kudos-leaderboard")
+def leaderboard_cmd(ack, command):
+    # rendered from memory, so it's answered right in the ack
+    window = leaderboard_window(command.get("text"))
+
+    # opted out users don't show up on it. until the replica has loaded that's one query for
+    # the people on the board, and if supabase can't answer it the board waits too
+    users = leaderboard.users(window)
+    hidden = fetch_opted_out(users, fallback=False) if leaderboard.ready else None
+    if hidden is None:
+        ack(text="The leaderboard is still loading, try again in a minute! :neocat_blank:")
+        return
+
+    ack(blocks=leaderboard_blocks(window, leaderboard.top(window, skip=hidden, among=users)))
+
+
+@app.command("/kudos-digest")
+def digest_cmd(ack, command):
+    # a local sqlite lookup, so it's answered right in the ack
+    user_id = command["user_id"]
+    choice = (command.get("text") or "").strip().lower()
+    every = describe_interval(digest.interval)
+
+    try:
+        if choice == "on":
+            digest.enable(user_id)
+            ack(text=f"Digest mode is on! From now on you'll get all your kudos in one DM every {every}. :neocat_cute:")
+        elif choice == "off":
+            digest.disable(user_id)
+            ack(text="Digest mode is off! Anything waiting for your digest is on its way now, and new kudos will come right away. :neocat_heart:")
+        elif digest.wants(user_id):
+            ack(text=f"You're getting your kudos in one DM every {every}. Turn that off with `/kudos-digest off`.")
+        else:
+            ack(text=f"You're getting every kudos as it's sent. Run `/kudos-digest on` to get them in one DM every {every} instead.")
+    except Exception as e:
+        print(f"Error when changing digest mode! {e}")
+        ack(text="Oops! Unable to change your digest setting right now. Please try again later. :neocat_sad_reach:")
+
+
+def ack_command(ack):
     ack()
+
+@timed_handler("/my-kudos")
+@traced("/my-kudos")
+def kudos_cmd(command, respond):
     user_id = command["user_id"]
     
-    if not check_if_opt_out:
+    if check_if_opt_out(user_id):
         respond(text="You have opted out and your unable to see your stats. Please opt-in to see your stats! :neocat_blank:")
         return
     
-    sent_count, recieved_count = fetch_kudos_stats(user_id)
-
-    stat_blocks = [
-        
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "Your Kudos Stats! :neocat_heart:",
-				"emoji": True
-			}
-		},
-		{
-			"type": "divider"
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "mrkdwn",
-				"text": f"*Kudos Sent:*\n{sent_count}"
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "mrkdwn",
-				"text": f"*Kudos Received:*\n{recieved_count}"
-			}
-		},
-		{
-			"type": "divider"
-		},
-		{
-			"type": "context",
-			"elements": [
-				{
-					"type": "plain_text",
-					"text": "Keep on sending kudos!",
-					"emoji": True
-				}
-			]
-		}
-	]
-    respond(blocks=stat_blocks)
-
-
-
-@app.command("/give-kudos")
-def give_a_kudo(ack, command, client, say, respond):
-    ack()
-    sender_id = command["user_id"]
+    stats = fetch_kudos_stats(user_id)
 
-    
-    if check_if_opt_out(sender_id):
-        respond(text="You have opted out from this kudos system. You are unable to send kudos. To opt-in again, run /opt-in. :neocat_baa:", replace_original=False)
+    if stats is None:
+        respond(text="Oops! Unable to load your stats right now. Please try again later. :neocat_sad_reach:")
         return
 
-    if not check_usr_agreement(sender_id):
-        respond(
-            text="It looks like you haven't agreed to our guidelines, please read it first!",
-            blocks=get_rules_block()
-        )
-        return
-    txt = command["text"]
+    respond(blocks=stat_blocks(stats))
 
+app.command("/my-kudos")(ack=ack_command, lazy=[kudos_cmd])
 
 
-    usr_match = re.search(r"<@([A-Za-z0-9]+)\|[^>]+>", txt)
+def data_cmd_ack(ack, command):
+    if not is_admin(command["user_id"]):
+        ack(text="Only kudos admins can export or erase data. To have your own data removed, please DM @areallyawesomeusername :neocat_blank:")
+        return
+    if parse_command(command.get("text")) is None:
+        ack(text="Usage: `/kudos-data export @user` or `/kudos-data erase @user`")
+        return
+    ack(text="On it! I'll let you know when it's done. :neocat_cute:")
+
+@timed_handler("/kudos-data")
+@traced("/kudos-data")
+def data_cmd(command, respond):
+    # streams and deletes in pages, see user_data.py
+    admin_id = command["user_id"]
+    parsed = parse_command(command.get("text"))
+    if not is_admin(admin_id) or parsed is None:
+        return
+    action, user_id = parsed
 
-    if not usr_match:
-            respond("Please mention a user to give kudos to.")
+    try:
+        if action == "export":
+            with tempfile.TemporaryDirectory() as directory:
+                path, written = export_to_file(supabase, user_id, directory)
+                channel = app.client.conversations_open(users=admin_id)["channel"]["id"]
+                app.client.files_upload_v2(channel=channel, file=path, filename=os.path.basename(path), initial_comment=f"Kudos data for <@{user_id}> ({written} rows)")
+            respond(text=f"Sent you <@{user_id}>'s data in a DM. :neocat_heart:")
             return
-    
-    recipient_id = usr_match.group(1)
 
+        deleted = erase_user(supabase, user_id, digest=digest, writer=kudos_writer)
+        user_state.mark_not_agreed(user_id)
+        last_known.mark(user_id, agreed=False)
+        leaderboard.reconcile()
+    except Exception as e:
+        print(f"Error when running /kudos-data {action} for {user_id}! {e}")
+        respond(text=f"Oops! Unable to {action} <@{user_id}>'s data. Please try again later. :neocat_sad_reach:")
+        return
 
-    if sender_id == recipient_id:
+    respond(text=erased_text(user_id, deleted))
+
+app.command("/kudos-data")(ack=data_cmd_ack, lazy=[data_cmd])
+
+
+
+@timed_handler("/give-kudos")
+@traced("/give-kudos")
+def give_a_kudo(command, client, say, respond, context):
+    sender_id = command["user_id"]
+    txt = command["text"]
+
+    recipient_ids, targets, reason = parse_give_kudos(txt)
+
+    if not recipient_ids and not targets:
+        respond("Please mention a user, user group or channel to give kudos to.")
+        return
+
+    skipped = {}
+
+    if sender_id in recipient_ids:
+        recipient_ids.remove(sender_id)
+        skipped[sender_id] = "that's you"
+
+    if not recipient_ids and not targets:
         respond(text='You cannot give kudos to yourself. :neocat_laugh:')
         return
 
-    if check_if_opt_out(recipient_id):
-        respond(f"Oops! <@{recipient_id}> has opted out. You cannot send kudos to this user. :neocat_sad_reach:")
+    if len(recipient_ids) > KUDOS_MAX_RECIPIENTS:
+        respond(f"You can give kudos to up to {KUDOS_MAX_RECIPIENTS} people at once. :neocat_sad_reach:")
         return
 
-    reason = txt.replace(usr_match.group(0), "").strip()
+    # the reason is moderated once for everybody and all the opt-outs come back in one query.
+    # user groups and channels get expanded here too, side by side with the other checks
+    opted_out = set()
+    resolved = list(recipient_ids)
+
+    def recipients_opted_out():
+        if targets:
+            try:
+                members = membership.resolve(targets)
+            except Exception as e:
+                print(f"Unable to look up group members {e}")
+                return "group_unavailable"
+            resolved[:] = [user_id for user_id in dict.fromkeys(recipient_ids + members) if user_id not in (sender_id, context.bot_user_id)]
+            if not resolved:
+                return "group_empty"
+            if len(resolved) > KUDOS_MAX_GROUP_SIZE:
+                return "group_too_big"
+            if not membership.includes(targets, sender_id):
+                return "not_a_member"
+        opted_out.update(fetch_opted_out(resolved))
+        # only blocks when there's nobody left to send to
+        return len(opted_out) == len(resolved)
+
+    blocked = run_preflight({
+        "gate": lambda: gate_blocker(sender_id, None),
+        "flagged": lambda: if_txt_flagged(reason),
+        "recipient_opted_out": recipients_opted_out,
+    })
+
+    reply = give_kudos_blocked_reply(blocked, resolved)
+    if reply:
+        respond(**reply)
+        return
 
-    if not reason:
-        reason = "being an awesome person!"
+    # people mentioned by name are listed when they're skipped, group members are just counted
+    for recipient_id in recipient_ids:
+        if recipient_id in opted_out:
+            skipped[recipient_id] = "opted out"
+    skipped_members = len(opted_out - set(recipient_ids))
+    named = [f"<@{recipient_id}>" for recipient_id in recipient_ids if recipient_id not in opted_out]
+    recipient_ids = [recipient_id for recipient_id in resolved if recipient_id not in opted_out]
 
-    if if_txt_flagged(reason):
-        respond(":neocat_0_0: This message has been flagged by our moderation system. Please rewrite your message!")
+    # slack retries envelopes, so make sure a kudos only goes out once across the whole fleet
+    if not idempotency.claim(request_key(command)):
         return
-    
+
     try:
-        kudos_data_collector(sender_id, recipient_id, reason)
-
-        msg_blocks = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f":neocat_heart: *You received a kudos from <@{sender_id}>*\n\n> {reason}"
-            }
-        },
-        {
-            "type": "actions",
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Return the favor :neocat_hug:",
-                        "emoji": True
-                    },
-                    "value": sender_id,
-                    "action_id": "return_kudos"
-                },
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Opt-out :neocat_sad_reach: ",
-                        "emoji": True
-                    },
-                    "style": "danger",
-                    "value": "opt_out_action",
-                    "action_id": "opt_out",
-                    "confirm": {
-                        "title": {
-                            "type": "plain_text",
-                            "text": "Opt-out?"
-                        },
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Are you sure you want to opt-out? You won't be able to send or recieve kudos anymore."
-                        },
-                        "confirm": {
-                            "type": "plain_text",
-                            "text": "Yes, opt-out"
-                        },
-                        "deny": {
-                            "type": "plain_text",
-                            "text": "Cancel"
-                        }
-                    }
-                }
-            ]
-        }
-    ]
-
-        client.chat_postMessage(
-            channel=recipient_id,
-            text=f":neocat_heart: You recieved a kudos from <@{sender_id}> Here is the reason why! {reason}",
-            blocks=msg_blocks
-        )
-        respond(f"I have sucessfully sent a kudos to <@{recipient_id}>!")
+        kudos_data_collector(sender_id, recipient_ids, reason)
+        # every DM is its own job, the delivery workers send them side by side
+        for recipient_id in recipient_ids:
+            send_kudos_dm(sender_id, recipient_id, reason)
+        targets_named = named + [format_target(kind, target_id) for kind, target_id in targets] if targets else ()
+        respond(kudos_sent_text(recipient_ids, skipped, targets_named, skipped_members))
     except Exception as e:
         respond(f"Oops! Unable to send a kudos to the recipient. :( {e}")
 
+app.command("/give-kudos")(ack=ack_command, lazy=[give_a_kudo])
+
 @app.shortcut("give_kudos_shortcut")
 def kudo_shortcut_modal(ack, shortcut, client, body):
     ack()
@@ -516,265 +369,84 @@ def kudo_shortcut_modal(ack, shortcut, client, body):
 
     client.views_open(
         trigger_id=trigger_id,
-        view={
-    "type": "modal",
-    "callback_id" : "submit_kudos_view",
-    "private_metadata" : recipient_id,
-    "title": {
-        "type": "plain_text",
-        "text": "KudosGiver",
-        "emoji": True
-    },
-    "submit": {
-        "type": "plain_text",
-        "text": "Give Kudos",
-        "emoji": True
-    },
-    "close": {
-        "type": "plain_text",
-        "text": "Cancel",
-        "emoji": True
-    },
-    "blocks": [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f"*You are about to give a kudos to <@{recipient_id}>*"
-            }
-        },
-        {
-            "type": "input",
-            "block_id" : "reason_block",
-            "element": {
-                "type": "plain_text_input",
-                "action_id": "reason_action"
-            },
-            "label": {
-                "type": "plain_text",
-                "text": "Reason",
-                "emoji": True
-            },
-            "optional": True
-        }
-    ]
-}
+        view=kudos_modal(recipient_id)
     )
 
 
-@app.view("submit_kudos_view")
-def handle_submission(ack, client, body, view):
+def ack_kudos_view(ack, view):
+    # slack gives us 3 seconds to answer a view submission, so answer right away with a
+    # "sending" screen. the lazy listener does the checks and updates the modal afterwards.
+    ack(response_action="update", view=modal_notice(view["title"], "Sending your kudos... :neocat_cute:"))
+
+def send_kudos_from_view(client, body, view, typed_reason, default_reason, build_modal):
     sender_id = body["user"]["id"]
+    recipient_id = view["private_metadata"]
 
-    if not check_usr_agreement(sender_id):
-        ack(response_action="errors", errors={
-            "reason_block": "You haven't agreed to our guidelines! To use this service, run the /opt-in command."
-        })
-        return
+    def reject(error):
+        client.views_update(view_id=view["id"], view=build_modal(recipient_id, typed_reason, error))
 
-    if check_if_opt_out(sender_id):
-        ack(response_action="errors", errors={
-            "reason_block": "You have opted out and unable to send kudos. To opt-in, run the /opt-in command."
-        })
+    if sender_id == recipient_id:
+        reject("You cannot give kudos to yourself!")
         return
-    
-    reason= view["state"]["values"]["reason_block"]["reason_action"]["value"]
 
-    if not reason:
-        reason = "being awesome!"
+    reason = typed_reason or default_reason
 
-    if if_txt_flagged(reason):
-        ack(response_action="errors", errors={
-            "reason_block": "This message has been flagged by our moderation system. Please rewrite your message."
-        })
-        return
-    
-    recipient_id = view["private_metadata"]
-    
+    blocked = run_preflight({
+        "gate": lambda: gate_blocker(sender_id, recipient_id),
+        "flagged": lambda: if_txt_flagged(reason),
+    })
 
-
-    if check_if_opt_out(recipient_id):
-        ack(response_action="errors", errors={
-            "reason_block": f"Oops! <@{recipient_id} has opted out. You cannot send kudos to this user. :neocat_sad_reach:"
-        })
+    error = view_blocked_text(blocked, recipient_id)
+    if error:
+        reject(error)
         return
-    ack()
 
-    sender_id = body["user"]["id"]
+    if not idempotency.claim(request_key(body, view)):
+        return
 
     try:
-        kudos_data_collector(sender_id, recipient_id, reason)
-        msg_blocks = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f":neocat_heart: *You received kudos from <@{sender_id}>*\n\n> {reason}"
-            }
-        },
-        {
-            "type": "actions",
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Return the favor :neocat_hug:",
-                        "emoji": True
-                    },
-                    "value": sender_id,
-                    "action_id": "return_kudos"
-                },
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Opt-out :neocat_sad_reach: ",
-                        "emoji": True
-                    },
-                    "style": "danger",
-                    "value": "opt_out_action",
-                    "action_id": "opt_out",
-                    "confirm": {
-                        "title": {
-                            "type": "plain_text",
-                            "text": "Opt-out?"
-                        },
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Are you sure you want to opt-out? You won't be able to send or recieve kudos anymore."
-                        },
-                        "confirm": {
-                            "type": "plain_text",
-                            "text": "Yes, opt-out"
-                        },
-                        "deny": {
-                            "type": "plain_text",
-                            "text": "Cancel"
-                        }
-                    }
-                }
-            ]
-        }
-    ]
-        client.chat_postMessage(
-            channel=recipient_id,
-            text=f":neocat_heart: You recieved a kudos from <@{sender_id}> Here is the reason why! {reason}",
-            blocks=msg_blocks
-        )
+        kudos_data_collector(sender_id, [recipient_id], reason)
+        send_kudos_dm(sender_id, recipient_id, reason)
+        client.views_update(view_id=view["id"], view=modal_notice(view["title"], f"Your kudos to <@{recipient_id}> is on its way! :neocat_heart:"))
     except Exception as e:
         print(f"Error sending the kudos! {e}")
+        client.views_update(view_id=view["id"], view=modal_notice(view["title"], "Oops! Unable to send a kudos to the recipient. :("))
 
-@app.view("return_kudos_submission")
-def return_submission_handler(ack, body, client, view):
-    sender_id = body["user"]["id"]
-    recipient_id = view["private_metadata"]
+@timed_handler("submit_kudos_view")
+@traced("submit_kudos_view")
+def handle_submission(client, body, view):
+    typed_reason = view["state"]["values"]["reason_block"]["reason_action"]["value"]
+    send_kudos_from_view(client, body, view, typed_reason, "being awesome!", kudos_modal)
 
-    if sender_id == recipient_id:
-        ack(response_action="errors", errors={
-            "reason_block": "You cannot give kudos to yourself!"
-            })
-        return
+app.view("submit_kudos_view")(ack=ack_kudos_view, lazy=[handle_submission])
 
-    if not check_usr_agreement(sender_id):
-        ack(response_action="errors", errors={
-            "reason_block": "You haven't agreed to our guidelines! To use this service, run the /opt-in command."
-            })
-        return
+@timed_handler("return_kudos_submission")
+@traced("return_kudos_submission")
+def return_submission_handler(client, body, view):
+    typed_reason = view["state"]["values"]["return_reason_block"]["reason_action"]["value"]
+    send_kudos_from_view(client, body, view, typed_reason, "returning the favor!", return_kudos_modal)
 
+app.view("return_kudos_submission")(ack=ack_kudos_view, lazy=[return_submission_handler])
 
-    if check_if_opt_out(sender_id):
-            ack(response_action="errors", errors={
-                "reason_block": "You have opted out and unable to send kudos. To opt-in, run the /opt-in command."
-            })
-            return
-    
-    reason= view["state"]["values"]["return_reason_block"]["reason_action"]["value"]
 
-    
+# keep the membership index honest between refreshes
+@app.event("member_joined_channel")
+def member_joined_channel(event):
+    membership.invalidate("channel", event["channel"])
 
-    if not reason:
-        reason = "returning the favor!"
+@app.event("member_left_channel")
+def member_left_channel(event):
+    membership.invalidate("channel", event["channel"])
 
-    if if_txt_flagged(reason):
-        ack(response_action="errors", errors={
-            "return_reason_block": "This message has been flagged by our moderation system. Please rewrite your message."
-        })
-        return
-    
-    ack()
-    recipient_id = view["private_metadata"]
-
-    if check_if_opt_out(recipient_id):
-        ack(response_action="errors", errors={
-            "reason_block": f"Oops! <@{recipient_id} has opted out. You cannot send kudos to this user. :neocat_sad_reach:"
-        })
-        return
+@app.event("subteam_members_changed")
+def subteam_members_changed(event):
+    membership.invalidate("subteam", event["subteam_id"])
 
-    
-
-    try:
-        kudos_data_collector(sender_id, recipient_id, reason)
-        msg_blocks = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f":neocat_heart: *You received a kudos from <@{sender_id}>*\n\n> {reason}"
-            }
-        },
-        {
-            "type": "actions",
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Return the favor :neocat_hug:",
-                        "emoji": True
-                    },
-                    "value": sender_id,
-                    "action_id": "return_kudos"
-                },
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "Opt-out :neocat_sad_reach: ",
-                        "emoji": True
-                    },
-                    "style": "danger",
-                    "value": "opt_out_action",
-                    "action_id": "opt_out",
-                    "confirm": {
-                        "title": {
-                            "type": "plain_text",
-                            "text": "Opt-out?"
-                        },
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Are you sure you want to opt-out? You won't be able to send or recieve kudos anymore."
-                        },
-                        "confirm": {
-                            "type": "plain_text",
-                            "text": "Yes, opt-out"
-                        },
-                        "deny": {
-                            "type": "plain_text",
-                            "text": "Cancel"
-                        }
-                    }
-                }
-            ]
-        }
-    ]
-        client.chat_postMessage(
-            channel=recipient_id,
-            text=f":neocat_heart: You recieved a kudos from <@{sender_id}> Here is the reason why! {reason}",
-            blocks=msg_blocks
-        )
-    except Exception as e:
-        print(f"Error sending the kudos! {e}")
+# and the bot list, so new bots are left out right away. deactivations wait for the next
+# users.list walk, user_change fires on every profile and status edit and is too busy to follow
+@app.event("team_join")
+def team_join(event):
+    membership.bots.note(event["user"])
 
 
 @app.action("return_kudos")
@@ -785,42 +457,7 @@ def return_kudos_handler(ack, body, client):
 
     client.views_open(
         trigger_id=trigger_id,
-        view={
-    "type": "modal",
-    "callback_id": "return_kudos_submission",
-    "private_metadata": origin_sender,
-    "title": {
-        "type": "plain_text",
-        "text": "Return Kudos",
-        "emoji": True
-    },
-    "submit": {
-        "type": "plain_text",
-        "text": "Send Back",
-        "emoji": True
-    },
-    "close": {
-        "type": "plain_text",
-        "text": "Cancel",
-        "emoji": True
-    },
-    "blocks": [
-        {
-            "type": "input",
-            "block_id": "return_reason_block",
-            "element": {
-                "type": "plain_text_input",
-                "action_id": "reason_action"
-            },
-            "label": {
-                "type": "plain_text",
-                "text": "Reason",
-                "emoji": True
-            },
-            "optional": True
-        }
-    ]
-}
+        view=return_kudos_modal(origin_sender)
     )
 
 
@@ -848,4 +485,12 @@ def opt_out_handler(ack, body, respond):
 
 
 if __name__ == "__main__":
+    start_metrics_server()
+    start_warmer(http_client, [f"{SUPABASE_URL}/rest/v1/", MODERATION_URL])
+    user_state.start()
+    kudos_writer.start()
+    leaderboard.start()
+    delivery.start()
+    digest.start()
+    membership.bots.start()
     SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
\ No newline at end of file
@@ -0,0 +1,260 @@
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+from tracing import span
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "9464")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# tiny prometheus style registry. nothing fancy, just counters, gauges and histograms with
+# labels, rendered in the text exposition format on /metrics.
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        # callback returns {label values tuple: value}, for numbers that are kept somewhere else
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _items(self):
+        if self.callback:
+            return list(self.callback().items())
+        with self._lock:
+            return list(self._values.items())
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        return self.header() + [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in self._items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        return self.header() + [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in self._items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    "kudos_handler_seconds", "Time spent in each Bolt handler.", ["handler"]))
+handler_errors = registry.register(Counter(
+    "kudos_handler_errors_total", "Bolt handlers that raised.", ["handler"]))
+dependency_seconds = registry.register(Histogram(
+    "kudos_dependency_seconds", "Time spent waiting on external calls.", ["dependency", "operation"]))
+dependency_errors = registry.register(Counter(
+    "kudos_dependency_errors_total", "External calls that failed.", ["dependency", "operation"]))
+
+_cache_sources = {}
+
+
+def register_cache(name, source):
+    # source returns (hits, misses) for a cache that already keeps its own counts
+    _cache_sources[name] = source
+
+
+def _cache_lookups():
+    lookups = {}
+    for name, source in _cache_sources.items():
+        hits, misses = source()
+        lookups[(name, "hit")] = hits
+        lookups[(name, "miss")] = misses
+    return lookups
+
+
+def _cache_hit_ratio():
+    ratios = {}
+    for name, source in _cache_sources.items():
+        hits, misses = source()
+        total = hits + misses
+        ratios[(name,)] = hits / total if total else 0.0
+    return ratios
+
+
+registry.register(Counter(
+    "kudos_cache_lookups_total", "Lookups against the in-process caches.", ["cache", "result"], callback=_cache_lookups))
+registry.register(Gauge(
+    "kudos_cache_hit_ratio", "Hit ratio of the in-process caches.", ["cache"], callback=_cache_hit_ratio))
+
+
+@contextmanager
+def track(dependency, operation):
+    # also a child span when the call happens inside a sampled trace
+    started = time.perf_counter()
+    try:
+        with span(f"{dependency}.{operation}", dependency=dependency, operation=operation):
+            yield
+    except Exception:
+        dependency_errors.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        dependency_seconds.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+
+
+def timed_handler(name):
+    # functools.wraps keeps the signature visible to Bolt, which picks listener args by name
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    handler_errors.inc(handler=name)
+                    raise
+                finally:
+                    handler_seconds.observe(time.perf_counter() - started, handler=name)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler=name)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - started, handler=name)
+        return wrapper
+    return decorator
+
+
+class TimedWebClient(WebClient):
+    # every slack method goes through api_call, so timing it here covers all of them
+    def api_call(self, api_method, **kwargs):
+        with track("slack", api_method):
+            return super().api_call(api_method, **kwargs)
+
+
+class TimedAsyncWebClient(AsyncWebClient):
+    async def api_call(self, api_method, **kwargs):
+        with track("slack", api_method):
+            return await super().api_call(api_method, **kwargs)
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    except OSError as e:
+        print(f"Unable to start the metrics server on {host}:{port} {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,15 @@
+-- Everything the kudos gate needs to know about a sender/recipient pair in one round trip.
+-- Called from the bot with supabase.rpc("kudos_gate_state", {"sender": ..., "recipient": ...}).
+-- recipient can be null when only the sender matters (/opt-out, /opt-in, /my-kudos).
+
+CREATE OR REPLACE FUNCTION kudos_gate_state(sender TEXT, recipient TEXT DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'sender_opted_out', EXISTS (SELECT 1 FROM kudos_opt_out WHERE user_id = sender),
+        'sender_agreed', EXISTS (SELECT 1 FROM user_agreements WHERE user_id = sender),
+        'recipient_opted_out', recipient IS NOT NULL AND EXISTS (SELECT 1 FROM kudos_opt_out WHERE user_id = recipient)
+    );
+$$;
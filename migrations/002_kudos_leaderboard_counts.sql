@@ -0,0 +1,17 @@
+-- Kudos sent and received per user since a point in time, used by the leaderboard to
+-- reconcile its in-memory counters. since = null counts everything (the all time board).
+-- Called from the bot with supabase.rpc("kudos_leaderboard_counts", {"since": ...}), paged with range().
+
+CREATE INDEX IF NOT EXISTS collect_kudos_created_at_idx ON collect_kudos (created_at);
+
+CREATE OR REPLACE FUNCTION kudos_leaderboard_counts(since TIMESTAMPTZ DEFAULT NULL)
+RETURNS TABLE (role TEXT, user_id TEXT, kudos BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT 'sender', sender_id, count(*) FROM collect_kudos
+        WHERE since IS NULL OR created_at >= since GROUP BY sender_id
+    UNION ALL
+    SELECT 'recipient', recipient_id, count(*) FROM collect_kudos
+        WHERE since IS NULL OR created_at >= since GROUP BY recipient_id;
+$$;
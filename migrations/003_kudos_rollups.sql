@@ -0,0 +1,139 @@
+-- Daily per-user sent/received buckets and per-pair counts for /my-kudos. Triggers on
+-- collect_kudos keep them up to date on every insert and delete, so the stats never have to
+-- scan the raw kudos. Run it once, it backfills from collect_kudos at the end.
+-- Called from the bot with supabase.rpc("kudos_user_stats", {"target": ..., "week_start": ..., "month_start": ...}).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS kudos_daily_rollups (
+    user_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS kudos_pair_counts (
+    sender_id TEXT NOT NULL,
+    recipient_id TEXT NOT NULL,
+    kudos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sender_id, recipient_id)
+);
+
+CREATE INDEX IF NOT EXISTS kudos_pair_counts_sender_idx ON kudos_pair_counts (sender_id, kudos DESC);
+
+-- statement level with transition tables, so a bulk insert from the bot is one upsert per table
+CREATE OR REPLACE FUNCTION kudos_rollups_on_insert() RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO kudos_daily_rollups AS r (user_id, day, sent, received)
+    SELECT user_id, day, sum(sent), sum(received) FROM (
+        SELECT sender_id AS user_id, (created_at AT TIME ZONE 'utc')::date AS day, 1 AS sent, 0 AS received FROM new_rows
+        UNION ALL
+        SELECT recipient_id, (created_at AT TIME ZONE 'utc')::date, 0, 1 FROM new_rows
+    ) changes
+    GROUP BY user_id, day
+    ON CONFLICT (user_id, day) DO UPDATE SET sent = r.sent + EXCLUDED.sent, received = r.received + EXCLUDED.received;
+
+    INSERT INTO kudos_pair_counts AS p (sender_id, recipient_id, kudos)
+    SELECT sender_id, recipient_id, count(*) FROM new_rows GROUP BY sender_id, recipient_id
+    ON CONFLICT (sender_id, recipient_id) DO UPDATE SET kudos = p.kudos + EXCLUDED.kudos;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION kudos_rollups_on_delete() RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE kudos_daily_rollups r SET sent = r.sent - d.sent, received = r.received - d.received
+    FROM (
+        SELECT user_id, day, sum(sent) AS sent, sum(received) AS received FROM (
+            SELECT sender_id AS user_id, (created_at AT TIME ZONE 'utc')::date AS day, 1 AS sent, 0 AS received FROM old_rows
+            UNION ALL
+            SELECT recipient_id, (created_at AT TIME ZONE 'utc')::date, 0, 1 FROM old_rows
+        ) changes
+        GROUP BY user_id, day
+    ) d
+    WHERE r.user_id = d.user_id AND r.day = d.day;
+
+    DELETE FROM kudos_daily_rollups r USING old_rows o
+    WHERE r.sent <= 0 AND r.received <= 0
+        AND r.user_id IN (o.sender_id, o.recipient_id) AND r.day = (o.created_at AT TIME ZONE 'utc')::date;
+
+    UPDATE kudos_pair_counts p SET kudos = p.kudos - d.kudos
+    FROM (SELECT sender_id, recipient_id, count(*) AS kudos FROM old_rows GROUP BY sender_id, recipient_id) d
+    WHERE p.sender_id = d.sender_id AND p.recipient_id = d.recipient_id;
+
+    DELETE FROM kudos_pair_counts WHERE kudos <= 0;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS collect_kudos_rollups_insert ON collect_kudos;
+CREATE TRIGGER collect_kudos_rollups_insert AFTER INSERT ON collect_kudos
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION kudos_rollups_on_insert();
+
+DROP TRIGGER IF EXISTS collect_kudos_rollups_delete ON collect_kudos;
+CREATE TRIGGER collect_kudos_rollups_delete AFTER DELETE ON collect_kudos
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION kudos_rollups_on_delete();
+
+-- rebuilds both tables from collect_kudos. safe to run again any time the numbers look off,
+-- writes to collect_kudos wait until it's done
+CREATE OR REPLACE FUNCTION kudos_rebuild_rollups() RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    LOCK TABLE collect_kudos IN SHARE MODE;
+    DELETE FROM kudos_daily_rollups;
+    DELETE FROM kudos_pair_counts;
+
+    INSERT INTO kudos_daily_rollups (user_id, day, sent, received)
+    SELECT user_id, day, sum(sent), sum(received) FROM (
+        SELECT sender_id AS user_id, (created_at AT TIME ZONE 'utc')::date AS day, 1 AS sent, 0 AS received FROM collect_kudos
+        UNION ALL
+        SELECT recipient_id, (created_at AT TIME ZONE 'utc')::date, 0, 1 FROM collect_kudos
+    ) changes
+    GROUP BY user_id, day;
+
+    INSERT INTO kudos_pair_counts (sender_id, recipient_id, kudos)
+    SELECT sender_id, recipient_id, count(*) FROM collect_kudos GROUP BY sender_id, recipient_id;
+END;
+$$;
+
+SELECT kudos_rebuild_rollups();
+
+-- windowed totals for one user plus the people they've thanked the most. week_start and
+-- month_start come from the bot so every window lines up with the leaderboard's (utc)
+CREATE OR REPLACE FUNCTION kudos_user_stats(target TEXT, week_start DATE, month_start DATE, top_n INTEGER DEFAULT 3)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'sent_week', COALESCE(sum(sent) FILTER (WHERE day >= week_start), 0),
+        'received_week', COALESCE(sum(received) FILTER (WHERE day >= week_start), 0),
+        'sent_month', COALESCE(sum(sent) FILTER (WHERE day >= month_start), 0),
+        'received_month', COALESCE(sum(received) FILTER (WHERE day >= month_start), 0),
+        'sent_all', COALESCE(sum(sent), 0),
+        'received_all', COALESCE(sum(received), 0),
+        'top_thanked', (
+            SELECT COALESCE(jsonb_agg(jsonb_build_object('user_id', recipient_id, 'kudos', kudos) ORDER BY kudos DESC, recipient_id), '[]'::jsonb)
+            FROM (
+                SELECT recipient_id, kudos FROM kudos_pair_counts
+                WHERE sender_id = target
+                ORDER BY kudos DESC, recipient_id
+                LIMIT top_n
+            ) top
+        )
+    )
+    FROM kudos_daily_rollups
+    WHERE user_id = target;
+$$;
+
+COMMIT;
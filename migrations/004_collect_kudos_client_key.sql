@@ -0,0 +1,9 @@
+-- A key the bot generates for every kudos row before it's sent, so a batch that timed out
+-- (or failed) after Postgres had already committed it can be replayed without duplicating
+-- rows. The kudos writer inserts with on_conflict=client_key and ignore-duplicates, which
+-- is ON CONFLICT (client_key) DO NOTHING, so the rollup triggers don't fire for a replayed row.
+-- Rows written before this migration keep a null key (nulls never conflict).
+
+ALTER TABLE collect_kudos ADD COLUMN IF NOT EXISTS client_key UUID;
+
+CREATE UNIQUE INDEX IF NOT EXISTS collect_kudos_client_key_idx ON collect_kudos (client_key);
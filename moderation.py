@@ -0,0 +1,430 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from metrics import registry, track, Counter, Histogram
+from preflight import current_deadline
+from tracing import span
+
+CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "4096"))
+CACHE_TTL = float(os.getenv("MODERATION_CACHE_TTL", "86400"))
+BATCH_MS = float(os.getenv("MODERATION_BATCH_MS", "5"))
+BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", "32"))
+BATCH_WORKERS = int(os.getenv("MODERATION_BATCH_WORKERS", "8"))
+TERMS_PATH = os.getenv("MODERATION_TERMS_PATH", "")
+# "kys" is three letters, so only one or two characters skip the api
+TRIVIAL_LENGTH = int(os.getenv("MODERATION_TRIVIAL_LENGTH", "2"))
+MODERATION_TIMEOUT = float(os.getenv("MODERATION_TIMEOUT", "2"))
+HEDGE_MS = float(os.getenv("MODERATION_HEDGE_MS", "250"))
+# "block" turns the kudos away with a try again later, "allow" lets it through unchecked
+DEGRADED_MODE = os.getenv("MODERATION_DEGRADED_MODE", "block").lower()
+
+# what a moderation check can come back with. UNAVAILABLE means nobody could tell in time,
+# which isn't the same as FLAGGED, so callers decide what to do with it (see DEGRADED_MODE)
+FLAGGED = "flagged"
+CLEAN = "clean"
+UNAVAILABLE = "unavailable"
+
+# leave the handler a moment to answer after moderation gives up
+DEADLINE_MARGIN = 0.1
+# latencies needed before the hedge delay follows the p95 instead of MODERATION_HEDGE_MS
+MIN_SAMPLES = 20
+
+verdicts = registry.register(Counter(
+    "kudos_moderation_verdicts_total", "Moderation verdicts by the tier that decided them.", ["tier", "verdict"]))
+batch_sizes = registry.register(Histogram(
+    "kudos_moderation_batch_size", "Texts sent in each moderation call.", buckets=(1, 2, 4, 8, 16, 32, 64)))
+hedges = registry.register(Counter(
+    "kudos_moderation_hedges_total", "Hedged moderation calls, by which attempt answered.", ["winner"]))
+
+# the canned reasons the handlers fall back to, these never need the api
+DEFAULT_REASONS = [
+    "being an awesome person!",
+    "being awesome!",
+    "returning the favor!",
+]
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def verdict_of(flagged):
+    return FLAGGED if flagged else CLEAN
+
+
+def count_verdict(tier, verdict):
+    verdicts.inc(tier=tier, verdict=verdict)
+
+
+def moderation_deadline():
+    # the handler's remaining budget when we're inside a preflight, capped at MODERATION_TIMEOUT
+    deadline = time.monotonic() + MODERATION_TIMEOUT
+    budget = current_deadline()
+    if budget is not None:
+        deadline = min(deadline, budget - DEADLINE_MARGIN)
+    return deadline
+
+
+class LatencyTracker:
+    # recent moderation call latencies. a call still going after the p95 is probably stuck
+    # behind something, so that's when a second copy of it goes out
+
+    def __init__(self, size=200, fallback_ms=HEDGE_MS):
+        self.fallback = fallback_ms / 1000
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        # None when hedging is off
+        if self.fallback <= 0:
+            return None
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return self.fallback
+            samples = sorted(self._samples)
+        return samples[int(len(samples) * 0.95) - 1]
+
+
+def cache_key(text):
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    # LRU + TTL cache of moderation verdicts. pinned entries never expire or get evicted.
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def pin(self, text, flagged):
+        self._pinned[cache_key(text)] = flagged
+
+    def get(self, text):
+        key = cache_key(text)
+        with self._lock:
+            if key in self._pinned:
+                self.hits += 1
+                return self._pinned[key]
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                flagged, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return flagged
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, text, flagged):
+        key = cache_key(text)
+        with self._lock:
+            self._entries[key] = (flagged, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+
+# the shortcodes people actually thank each other with. anything else between colons can be
+# any text at all (":go_away:"), so it isn't taken as emoji and goes to the api
+KNOWN_SHORTCODES = frozenset((
+    "+1", "thumbsup", "clap", "tada", "wave", "heart", "hearts", "heart_eyes", "raised_hands", "pray",
+    "fire", "star", "star2", "sparkles", "100", "muscle", "trophy", "medal", "sports_medal", "rocket",
+    "smile", "smiley", "grin", "slightly_smiling_face", "blush", "joy", "hugging_face", "partying_face",
+    "white_check_mark", "heavy_check_mark", "ok_hand", "handshake", "bow", "confetti_ball", "gift",
+    "skin-tone-2", "skin-tone-3", "skin-tone-4", "skin-tone-5", "skin-tone-6",
+))
+# unicode emoji, known :shortcodes:, and the joiners/variation selectors that glue them together.
+# the enclosed letters (circled U+2460-24FF, squared and regional indicators U+1F100-1F1FF) are
+# left out on purpose, they spell words just fine, so flags go to the api too
+EMOJI_ONLY = re.compile(
+    r"^(?:\s|:(?:" + "|".join(re.escape(code) for code in sorted(KNOWN_SHORTCODES)) + r"):"
+    r"|[\U0001F000-\U0001F0FF\U0001F200-\U0001FAFF\u2190-\u21FF\u2300-\u245F\u2500-\u27BF\u2B00-\u2BFF\uFE0F\u200D])+$"
+)
+# so a term still matches inside :custom_emoji_names: and snake_case
+TERM_SEPARATORS = re.compile(r"[_:]")
+# and when it's spelled in circled, squared, regional indicator or fullwidth letters
+ENCLOSED_LETTERS = {
+    start + i: chr(ord("a") + i)
+    for start in (0x24B6, 0x24D0, 0x1F110, 0x1F130, 0x1F150, 0x1F170, 0x1F1E6, 0xFF21, 0xFF41)
+    for i in range(26)
+}
+
+
+def load_terms(path):
+    # one term or phrase per line, # for comments
+    if not path:
+        return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    except OSError as e:
+        print(f"Unable to load moderation terms from {path} {e}")
+        return []
+
+
+def compile_terms(terms):
+    # every term in one regex, longest first so a phrase wins over a word inside it
+    terms = sorted({normalize(term) for term in terms if normalize(term)}, key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(term) for term in terms) + r")(?!\w)")
+
+
+class LocalModerator:
+    # in-process tier in front of the moderation api. text with a listed term is flagged right
+    # away, trivially short or emoji only text is clean, everything else goes to the api.
+
+    def __init__(self, terms=(), trivial_length=TRIVIAL_LENGTH):
+        self.pattern = compile_terms(terms)
+        self.trivial_length = trivial_length
+
+    def check(self, text):
+        # True when flagged, False when clean, None when the api has to decide
+        normalized = normalize(text)
+        if self.pattern and self.pattern.search(TERM_SEPARATORS.sub(" ", normalized.translate(ENCLOSED_LETTERS))):
+            count_verdict("terms", FLAGGED)
+            return True
+        if len(normalized) <= self.trivial_length or EMOJI_ONLY.match(normalized):
+            count_verdict("trivial", CLEAN)
+            return False
+        return None
+
+
+def make_local_moderator():
+    return LocalModerator(load_terms(TERMS_PATH))
+
+
+def make_verdict_cache():
+    cache = VerdictCache()
+    for reason in DEFAULT_REASONS:
+        cache.pin(reason, False)
+    return cache
+
+
+class ModerationBatcher:
+    # coalesces moderation checks from concurrent handlers. the first text starts a short window
+    # (BATCH_MS, or until BATCH_SIZE texts) and everything that shows up in it goes out as one
+    # moderations.create(input=[...]) call. each caller gets its own verdict back.
+    #
+    # every call has a deadline, the latest of the callers in its batch. if it hasn't answered
+    # after the hedge delay a duplicate goes out and whichever answers first wins. the sdk's own
+    # retries are off, they'd blow straight through the deadline.
+
+    def __init__(self, client, window_ms=BATCH_MS, max_items=BATCH_SIZE, workers=BATCH_WORKERS):
+        self.client = client.with_options(max_retries=0)
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.latency = LatencyTracker()
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        # a few batches can be in flight at once, so a slow call doesn't hold up the next window
+        self._senders = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moderation")
+        # the attempts themselves, up to two per batch
+        self._attempts = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="moderation-call")
+
+    def check(self, text, deadline=None):
+        # FLAGGED, CLEAN, or UNAVAILABLE when the api failed or didn't answer before the deadline
+        deadline = deadline or moderation_deadline()
+        with self._cond:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="moderation-batcher", daemon=True)
+                self._thread.start()
+            # the same text twice in one window is only sent once
+            key = cache_key(text)
+            waiter = self._pending.get(key)
+            if waiter is None:
+                waiter = self._pending[key] = [text, Future(), deadline]
+                self._cond.notify()
+            else:
+                waiter[2] = max(waiter[2], deadline)
+        with span("moderation.batch_wait"):
+            try:
+                return verdict_of(waiter[1].result(timeout=max(0, deadline - time.monotonic())))
+            except Exception as e:
+                print(f"Moderation unavailable {e!r}")
+                return UNAVAILABLE
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            while self._pending and len(batch) < self.max_items:
+                batch.append(self._pending.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        while True:
+            self._senders.submit(self._send, self._take_batch())
+
+    def _attempt(self, texts, deadline):
+        started = time.monotonic()
+        with track("moderation", "moderations.create"):
+            response = self.client.moderations.create(input=texts, timeout=max(0.05, deadline - started))
+        self.latency.observe(time.monotonic() - started)
+        return response
+
+    def _call(self, texts, deadline):
+        # the first answer from up to two attempts. a failed first attempt is hedged straight away
+        attempts = {self._attempts.submit(self._attempt, texts, deadline): "first"}
+        pending = set(attempts)
+        delay = self.latency.hedge_delay()
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        error = None
+        while pending:
+            wake = deadline if hedge_at is None else min(hedge_at, deadline)
+            done, pending = wait(pending, timeout=max(0, wake - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if len(attempts) > 1:
+                    hedges.inc(winner=attempts[future])
+                return response
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if hedge_at is not None and (now >= hedge_at or not pending):
+                hedge_at = None
+                hedge = self._attempts.submit(self._attempt, texts, deadline)
+                attempts[hedge] = "hedge"
+                pending.add(hedge)
+        if len(attempts) > 1:
+            hedges.inc(winner="none")
+        raise error or TimeoutError("moderation didn't answer before the deadline")
+
+    def _send(self, batch):
+        batch_sizes.observe(len(batch))
+        try:
+            response = self._call([text for text, _, _ in batch], max(deadline for _, _, deadline in batch))
+            for (_, future, _), result in zip(batch, response.results):
+                future.set_result(result.flagged)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+
+
+class AsyncModerationBatcher:
+    # same idea for async_main, on the event loop instead of a thread. a losing attempt gets
+    # cancelled here instead of running out its timeout
+
+    def __init__(self, client, window_ms=BATCH_MS, max_items=BATCH_SIZE):
+        self.client = client.with_options(max_retries=0)
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.latency = LatencyTracker()
+        self._pending = OrderedDict()
+        self._timer = None
+
+    async def check(self, text, deadline=None):
+        deadline = deadline or moderation_deadline()
+        key = cache_key(text)
+        waiter = self._pending.get(key)
+        if waiter is None:
+            waiter = self._pending[key] = [text, asyncio.get_running_loop().create_future(), deadline]
+            if len(self._pending) >= self.max_items:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        else:
+            waiter[2] = max(waiter[2], deadline)
+        with span("moderation.batch_wait"):
+            try:
+                # shield so one caller giving up doesn't cancel the verdict for everybody else
+                return verdict_of(await asyncio.wait_for(asyncio.shield(waiter[1]), max(0, deadline - time.monotonic())))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Moderation unavailable {e!r}")
+                return UNAVAILABLE
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = list(self._pending.values())
+        self._pending = OrderedDict()
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _attempt(self, texts, deadline):
+        started = time.monotonic()
+        with track("moderation", "moderations.create"):
+            response = await self.client.moderations.create(input=texts, timeout=max(0.05, deadline - started))
+        self.latency.observe(time.monotonic() - started)
+        return response
+
+    async def _call(self, texts, deadline):
+        attempts = {asyncio.ensure_future(self._attempt(texts, deadline)): "first"}
+        pending = set(attempts)
+        delay = self.latency.hedge_delay()
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        error = None
+        try:
+            while pending:
+                wake = deadline if hedge_at is None else min(hedge_at, deadline)
+                done, pending = await asyncio.wait(pending, timeout=max(0, wake - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if len(attempts) > 1:
+                        hedges.inc(winner=attempts[task])
+                    return response
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if hedge_at is not None and (now >= hedge_at or not pending):
+                    hedge_at = None
+                    hedge = asyncio.ensure_future(self._attempt(texts, deadline))
+                    attempts[hedge] = "hedge"
+                    pending.add(hedge)
+            if len(attempts) > 1:
+                hedges.inc(winner="none")
+            raise error or TimeoutError("moderation didn't answer before the deadline")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _send(self, batch):
+        batch_sizes.observe(len(batch))
+        try:
+            response = await self._call([text for text, _, _ in batch], max(deadline for _, _, deadline in batch))
+            for (_, future, _), result in zip(batch, response.results):
+                if not future.done():
+                    future.set_result(result.flagged)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
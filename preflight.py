@@ -0,0 +1,89 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "2.5"))
+PREFLIGHT_WORKERS = int(os.getenv("PREFLIGHT_WORKERS", "16"))
+
+# returned instead of a check name when the checks didn't finish before the deadline
+TIMED_OUT = "timed_out"
+# returned when a check raised. nobody knows if it would have blocked, so callers don't let it through
+CHECK_FAILED = "check_failed"
+
+_executor = ThreadPoolExecutor(max_workers=PREFLIGHT_WORKERS, thread_name_prefix="preflight")
+# when the running checks have to be done by (time.monotonic()), so a slow dependency can give up in time
+_deadline = contextvars.ContextVar("preflight_deadline", default=None)
+
+
+def current_deadline():
+    # None outside of a preflight
+    return _deadline.get()
+
+
+# checks is a dict of name -> function that returns True when the kudos should be blocked.
+# a check can also return a string, which is used as the reason instead of its name.
+# they all run at once and the first one that blocks wins, the rest get dropped. when several
+# finish together the one listed first wins, so put the most useful message first.
+# returns the name (or reason) of the blocking check, TIMED_OUT, CHECK_FAILED when a check
+# raised, or None when everything passed.
+
+def run_preflight(checks, timeout=PREFLIGHT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    order = list(checks)
+    # copy_context so the checks' calls stay in the caller's trace and see the deadline
+    token = _deadline.set(deadline)
+    futures = {_executor.submit(contextvars.copy_context().run, check): name for name, check in checks.items()}
+    _deadline.reset(token)
+    pending = set(futures)
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return TIMED_OUT
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: order.index(futures[f])):
+                try:
+                    blocked = future.result()
+                except Exception as e:
+                    print(f"Preflight check {futures[future]} failed {e}")
+                    return CHECK_FAILED
+                if blocked:
+                    return blocked if isinstance(blocked, str) else futures[future]
+        return None
+    finally:
+        # checks that already started can't be stopped, but anything still queued is dropped
+        for future in pending:
+            future.cancel()
+
+
+# same thing for async_main, but checks is a dict of name -> coroutine
+async def run_preflight_async(checks, timeout=PREFLIGHT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    order = list(checks)
+    # tasks copy the context when they're created
+    token = _deadline.set(deadline)
+    tasks = {asyncio.ensure_future(check): name for name, check in checks.items()}
+    _deadline.reset(token)
+    pending = set(tasks)
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return TIMED_OUT
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: order.index(tasks[t])):
+                try:
+                    blocked = task.result()
+                except Exception as e:
+                    print(f"Preflight check {tasks[task]} failed {e}")
+                    return CHECK_FAILED
+                if blocked:
+                    return blocked if isinstance(blocked, str) else tasks[task]
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,15 @@
+from blocks import kudos_message_blocks, payload_size, KUDOS_MESSAGE_TEMPLATE, OPT_OUT_BUTTON
+
+
+def test_template_fills_slots_and_shares_the_rest():
+    blocks = kudos_message_blocks("U1", "thanks {{sender_id}}")
+    assert blocks[0]["text"]["text"].endswith("> thanks {{sender_id}}")
+    assert blocks[1]["elements"][0]["value"] == "U1"
+    assert blocks[1]["elements"][1] is OPT_OUT_BUTTON
+    # the template itself is left alone
+    assert KUDOS_MESSAGE_TEMPLATE.blocks[1]["elements"][0]["value"] == "{{sender_id}}"
+
+
+def test_size_matches_the_serialized_payload():
+    reason = 'a "quoted"\nline with ✨'
+    assert KUDOS_MESSAGE_TEMPLATE.size(sender_id="U1", reason=reason) == payload_size(kudos_message_blocks("U1", reason))
@@ -0,0 +1,26 @@
+import time
+from digest import DigestBuffer
+
+
+def make_buffer(tmp_path):
+    # an interval nobody reaches during the test, _claim is called with a time past it
+    return DigestBuffer(None, path=str(tmp_path / "digest.db"), interval=3600)
+
+
+def test_dropped_digest_is_never_claimed(tmp_path):
+    digest = make_buffer(tmp_path)
+    digest.add("US", "UR", "thanks!")
+    assert digest.drop("UR") == 1
+    assert digest._claim("UR", time.time() + 7200) is None
+
+
+def test_erase_removes_everything_about_the_user(tmp_path):
+    digest = make_buffer(tmp_path)
+    digest.enable("UR")
+    digest.add("US", "UR", "thanks!")
+    digest.add("UR", "UX", "you too")
+    digest.add("US", "UX", "and you")
+    digest.erase("UR")
+    assert not digest.wants("UR")
+    assert digest._claim("UR", time.time() + 7200) is None
+    assert digest._claim("UX", time.time() + 7200) == [("US", "and you")]
@@ -0,0 +1,71 @@
+from groups import MembershipIndex, BotDirectory
+
+
+class FakeSlack:
+    def __init__(self, members, page=2):
+        self.members = members
+        self.page = page
+        self.member_calls = 0
+
+    def users_list(self, limit, cursor=None):
+        return {"members": [{"id": "UBOT", "is_bot": True}, {"id": "UGONE", "deleted": True}, {"id": "U1"}]}
+
+    def conversations_members(self, channel, limit, cursor=None):
+        self.member_calls += 1
+        start = int(cursor or 0)
+        end = start + self.page
+        return {"members": self.members[start:end], "response_metadata": {"next_cursor": str(end) if end < len(self.members) else ""}}
+
+
+def test_bots_and_deactivated_accounts_are_left_out():
+    slack = FakeSlack(["U1", "UBOT", "U2", "UGONE", "USLACKBOT"])
+    index = MembershipIndex(slack)
+    index.bots.refresh()
+    assert index.resolve([("channel", "C1")]) == ["U1", "U2"]
+
+
+def test_paging_stops_once_past_the_cap():
+    slack = FakeSlack([f"U{i}" for i in range(100)])
+    members = MembershipIndex(slack, max_members=3).members("channel", "C1")
+    assert len(members) == 4
+    assert slack.member_calls == 2
+
+
+def test_bot_list_follows_team_join_events():
+    slack = FakeSlack(["U1", "U2"])
+    index = MembershipIndex(slack)
+    index.bots.refresh()
+    index.bots.note({"id": "U2", "is_bot": True})
+    assert index.resolve([("channel", "C1")]) == ["U1"]
+
+
+class BrokenUsersList(FakeSlack):
+    def users_list(self, limit, cursor=None):
+        raise RuntimeError("ratelimited")
+
+
+def test_a_missing_bot_list_does_not_block_a_kudos():
+    slack = BrokenUsersList(["U1", "UBOT", "USLACKBOT"])
+    index = MembershipIndex(slack)
+    index.bots.refresh()
+    assert index.resolve([("channel", "C1")]) == ["U1", "UBOT"]
+
+
+def test_only_members_can_thank_a_team():
+    index = MembershipIndex(FakeSlack(["U1", "U2"]))
+    assert index.includes([("channel", "C1")], "U1")
+    assert not index.includes([("channel", "C1")], "U3")
+
+
+def test_workers_share_one_bot_list(tmp_path):
+    path = str(tmp_path / "bots.json")
+    walker = BotDirectory(FakeSlack([]), shared_path=path, walks=True)
+    walker.refresh()
+
+    class NoUsersList(FakeSlack):
+        def users_list(self, limit, cursor=None):
+            raise AssertionError("only worker 0 walks users.list")
+
+    reader = BotDirectory(NoUsersList([]), shared_path=path, walks=False)
+    reader.refresh()
+    assert reader.ids() == walker.ids() == {"USLACKBOT", "UBOT", "UGONE"}
@@ -0,0 +1,29 @@
+import asyncio
+from kudos_core import run_sync, run_async
+
+
+def steps():
+    first = yield lambda: 1
+    try:
+        yield lambda: 1 / 0
+    except ZeroDivisionError:
+        second = yield lambda: 2
+    return first + second
+
+
+async def answer(value):
+    return value
+
+
+def test_both_runtimes_drive_the_same_steps():
+    assert run_sync(steps()) == 3
+
+    def async_steps():
+        first = yield lambda: answer(1)
+        try:
+            yield lambda: answer(1 / 0)
+        except ZeroDivisionError:
+            second = yield lambda: answer(2)
+        return first + second
+
+    assert asyncio.run(run_async(async_steps())) == 3
@@ -0,0 +1,57 @@
+from kudos_writer import KudosWriter
+
+
+class FakeTable:
+    def __init__(self, calls, fail):
+        self.calls = calls
+        self.fail = fail
+
+    def upsert(self, rows, **options):
+        self.calls.append((rows, options))
+        return self
+
+    def execute(self):
+        if self.fail:
+            raise TimeoutError("timed out, but postgres may have committed it")
+
+
+class FakeSupabase:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def table(self, name):
+        return FakeTable(self.calls, self.fail)
+
+
+def test_a_replayed_batch_reuses_its_client_keys(tmp_path):
+    supabase = FakeSupabase(fail=True)
+    writer = KudosWriter(supabase, spill_path=str(tmp_path / "spill.db"))
+    writer.add_many("US", ["U1", "U2"], "thanks!")
+    writer.stop()
+
+    supabase.fail = False
+    writer._open_spill()
+    writer._replay()
+    first, replayed = supabase.calls[0], supabase.calls[-1]
+    keys = [row["client_key"] for row in first[0]]
+    assert len(set(keys)) == 2
+    assert [row["client_key"] for row in replayed[0]] == keys
+    assert replayed[1]["on_conflict"] == "client_key" and replayed[1]["ignore_duplicates"]
+
+
+def test_forget_drops_queued_and_spilled_rows(tmp_path):
+    supabase = FakeSupabase(fail=True)
+    writer = KudosWriter(supabase, spill_path=str(tmp_path / "spill.db"))
+    writer.add_many("US", ["U1", "U2"], "thanks!")
+    writer.stop()
+    # one more that never left the queue
+    writer._queue.put({"sender_id": "U1", "recipient_id": "U3", "reason": "hi", "created_at": "", "client_key": "k"})
+
+    assert writer.forget("U1") == 2
+    assert writer._queue.qsize() == 0
+
+    supabase.fail = False
+    writer._open_spill()
+    writer._replay()
+    assert [row["recipient_id"] for row in supabase.calls[-1][0]] == ["U2"]
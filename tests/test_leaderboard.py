@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta, timezone
+from leaderboard import Leaderboard, window_start
+
+
+def test_an_older_kudos_doesnt_roll_the_week_back():
+    leaderboard = Leaderboard(None)
+    leaderboard.record("US", "UR")
+    last_week = window_start("week", datetime.now(timezone.utc)) - timedelta(days=1)
+    leaderboard.record("UOLD", "UOLDER", when=last_week)
+
+    week = leaderboard.top("week")
+    assert week == {"recipient": [("UR", 1)], "sender": [("US", 1)]}
+    assert ("UOLDER", 1) in leaderboard.top("all")["recipient"]
+
+
+def test_only_checked_users_show_up():
+    leaderboard = Leaderboard(None)
+    leaderboard.record("US", "UR")
+    checked = leaderboard.users("week")
+    leaderboard.record("ULATE", "UR")
+    top = leaderboard.top("week", skip={"UR"}, among=checked)
+    assert top == {"recipient": [], "sender": [("US", 1)]}
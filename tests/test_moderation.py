@@ -0,0 +1,30 @@
+from moderation import LocalModerator
+
+
+def test_unicode_emoji_and_known_shortcodes_are_clean():
+    local = LocalModerator()
+    assert local.check("🎉🎉 👏") is False
+    assert local.check(":tada: :clap::skin-tone-2: :+1:") is False
+
+
+def test_unknown_shortcodes_go_to_the_api():
+    local = LocalModerator()
+    assert local.check(":go_kill_yourself: :wave:") is None
+    assert local.check(":you_are_useless:") is None
+
+
+def test_listed_terms_inside_shortcodes_are_flagged():
+    local = LocalModerator(["useless"])
+    assert local.check(":you_are_useless: :wave:") is True
+
+
+def test_enclosed_letters_are_not_emoji():
+    assert LocalModerator(["fuck"]).check("🅵🆄🅲🅺 🆈🅾🆄") is True
+    assert LocalModerator().check("🅵🆄🅲🅺 🆈🅾🆄") is None
+    assert LocalModerator().check("🇰🇮🇱🇱 🇾🇴🇺🇷🇸🇪🇱🇫") is None
+    assert LocalModerator().check("ⓚⓘⓛⓛ ⓨⓞⓤ") is None
+
+
+def test_three_letters_are_not_trivial():
+    assert LocalModerator().check("kys") is None
+    assert LocalModerator().check("ty") is False
@@ -0,0 +1,33 @@
+import asyncio
+from preflight import run_preflight, run_preflight_async, CHECK_FAILED
+from kudos_text import give_kudos_blocked_reply, view_blocked_text
+
+
+def raises():
+    raise RuntimeError("supabase is down")
+
+
+async def raises_async():
+    raises()
+
+
+async def passes_async():
+    return False
+
+
+def test_a_check_that_raises_blocks_the_kudos():
+    blocked = run_preflight({"gate": raises, "flagged": lambda: False})
+    assert blocked == CHECK_FAILED
+    assert give_kudos_blocked_reply(blocked, ["U1"]) is not None
+    assert view_blocked_text(blocked, "U1") is not None
+
+
+def test_a_check_that_raises_blocks_the_kudos_async():
+    blocked = asyncio.run(run_preflight_async({"gate": raises_async(), "flagged": passes_async()}))
+    assert blocked == CHECK_FAILED
+
+
+def test_unknown_results_are_not_let_through():
+    assert give_kudos_blocked_reply("gate", ["U1"]) is not None
+    assert view_blocked_text("gate", "U1") is not None
+    assert give_kudos_blocked_reply(None, ["U1"]) is None
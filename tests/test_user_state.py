@@ -0,0 +1,18 @@
+from user_state import LastKnownState
+
+
+def test_unknown_sender_is_not_assumed_to_have_agreed():
+    assert LastKnownState().state("U1") is None
+
+
+def test_known_sender_answers_from_what_was_seen():
+    last_known = LastKnownState()
+    last_known.remember("U1", "U2", {"sender_opted_out": False, "sender_agreed": True, "recipient_opted_out": True})
+    assert last_known.state("U1", "U2") == {"sender_opted_out": False, "sender_agreed": True, "recipient_opted_out": True}
+
+
+def test_sender_only_seen_as_a_recipient_is_unknown_unless_opted_out():
+    last_known = LastKnownState()
+    last_known.remember_opted_out(["U1", "U2"], {"U2"})
+    assert last_known.state("U1") is None
+    assert last_known.state("U2")["sender_opted_out"] is True
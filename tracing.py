@@ -0,0 +1,213 @@
+import atexit
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_PATH = os.getenv("TRACE_PATH", "kudos_traces.jsonl")
+
+# request scoped traces. every slack request gets a trace id taken from its trigger_id (or view
+# id, or event id) so the ack and the lazy handler that runs later land in the same trace.
+# metrics.track opens a child span for each supabase, moderation and slack call, and finished
+# spans go to a JSONL file, one span per line.
+
+_current = contextvars.ContextVar("kudos_span", default=None)
+
+
+class Span:
+    def __init__(self, trace_id, name, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def child(self, name, attributes=None):
+        return Span(self.trace_id, name, self.span_id, attributes)
+
+    def record(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class JsonlExporter:
+    # spans get written from a background thread so handlers never wait on the disk
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def export(self, record):
+        if not self._thread:
+            with self._start_lock:
+                if not self._thread:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+        self._queue.put(record)
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            while len(records) < 500:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in records
+            lines = [json.dumps(record, default=str) + "\n" for record in records if record is not None]
+            try:
+                with open(self.path, "a") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                print(f"Unable to write {len(lines)} spans to {self.path} {e}")
+            if stopping:
+                return
+
+
+exporter = JsonlExporter(TRACE_PATH)
+
+
+def correlation_id(body, view=None):
+    body = body or {}
+    view = view or body.get("view") or {}
+    return body.get("trigger_id") or view.get("id") or body.get("event_id") or body.get("envelope_id")
+
+
+def _trace_id(correlation):
+    if not correlation:
+        return uuid.uuid4().hex
+    return hashlib.sha256(correlation.encode("utf-8")).hexdigest()[:32]
+
+
+def _sampled(trace_id):
+    # decided from the trace id, so every part of one request makes the same call
+    if TRACE_SAMPLE_RATE >= 1:
+        return True
+    return int(trace_id[:8], 16) / 0xFFFFFFFF < TRACE_SAMPLE_RATE
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        exporter.export(span.record())
+
+
+@contextmanager
+def trace(name, body=None, view=None, **attributes):
+    # root span for one slack request. anything not sampled runs with no span at all
+    trace_id = _trace_id(correlation_id(body, view)) if TRACE_SAMPLE_RATE > 0 else None
+    if trace_id is None or not _sampled(trace_id):
+        token = _current.set(None)
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+    with _activate(Span(trace_id, name, attributes=attributes)) as span:
+        yield span
+
+
+@contextmanager
+def span(name, **attributes):
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(parent.child(name, attributes)) as child:
+        yield child
+
+
+@contextmanager
+def resume(parent):
+    # picks a trace back up on another thread, e.g. a delivery worker sending a queued DM
+    token = _current.set(parent)
+    try:
+        yield parent
+    finally:
+        _current.reset(token)
+
+
+def _request_attributes(body):
+    body = body or {}
+    attributes = {"type": body.get("type") or ("slash_command" if "command" in body else None)}
+    if body.get("command"):
+        attributes["command"] = body["command"]
+    view = body.get("view") or {}
+    if view.get("callback_id"):
+        attributes["callback_id"] = view["callback_id"]
+    return attributes
+
+
+# global bolt middleware, covers the ack of every request
+def bolt_middleware(body, next):
+    with trace("ack", body, **_request_attributes(body)):
+        return next()
+
+
+async def async_bolt_middleware(body, next):
+    with trace("ack", body, **_request_attributes(body)):
+        return await next()
+
+
+def traced(name):
+    # for lazy listeners. they run after the ack on another thread (or task), so they start their
+    # own root span in the same trace, using the payload they were handed
+    def start(kwargs):
+        body = kwargs.get("body") or kwargs.get("command")
+        return trace(name, body, kwargs.get("view"), handler=name)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start(kwargs):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start(kwargs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE = int(os.getenv("HTTP_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "90"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP2 = os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+HTTP_WARMUP_SECONDS = float(os.getenv("HTTP_WARMUP_SECONDS", "60"))
+HTTP_WARM_CONNECTIONS = int(os.getenv("HTTP_WARM_CONNECTIONS", "2"))
+
+# one keep-alive pool shared by supabase and the moderation client, instead of each library
+# making its own with default settings. a warmer opens connections at startup and touches them
+# again before they idle out, so the first kudos after a quiet spell skips the TCP/TLS setup.
+
+
+def _http2_available():
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("HTTP2 is on but the h2 package isn't installed, sticking to HTTP/1.1")
+        return False
+    return True
+
+
+def _client_settings():
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        "http2": _http2_available(),
+        "follow_redirects": True,
+    }
+
+
+def make_http_client():
+    return httpx.Client(**_client_settings())
+
+
+def make_async_http_client():
+    return httpx.AsyncClient(**_client_settings())
+
+
+def warm(client, urls, connections=HTTP_WARM_CONNECTIONS):
+    # HEAD each host a few times at once so there's more than one idle connection ready.
+    # the status doesn't matter, a 401 or 404 still leaves a warm connection behind
+    def touch(url):
+        try:
+            client.head(url)
+        except httpx.HTTPError as e:
+            print(f"Unable to warm up {url} {e}")
+
+    targets = [url for url in urls if url] * connections
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        list(pool.map(touch, targets))
+
+
+async def warm_async(client, urls, connections=HTTP_WARM_CONNECTIONS):
+    async def touch(url):
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            print(f"Unable to warm up {url} {e}")
+
+    await asyncio.gather(*[touch(url) for url in urls if url for _ in range(connections)])
+
+
+def start_warmer(client, urls, interval=HTTP_WARMUP_SECONDS):
+    warm(client, urls)
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            warm(client, urls)
+
+    thread = threading.Thread(target=run, name="http-warmer", daemon=True)
+    thread.start()
+    return thread
+
+
+async def run_async_warmer(client, urls, interval=HTTP_WARMUP_SECONDS):
+    # startup warm-up happens before this returns, the periodic one keeps going as a task
+    await warm_async(client, urls)
+    if interval <= 0:
+        return None
+
+    async def run():
+        while True:
+            await asyncio.sleep(interval)
+            await warm_async(client, urls)
+
+    return asyncio.ensure_future(run())
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from itertools import islice
+from postgrest import ReturnMethod
+from metrics import track
+from digest import DigestBuffer, DIGEST_PATH
+from kudos_writer import forget_spilled, SPILL_PATH
+from user_state import POLL_SECONDS
+
+EXPORT_PAGE_SIZE = int(os.getenv("KUDOS_EXPORT_PAGE_SIZE", "1000"))
+ERASE_BATCH_SIZE = int(os.getenv("KUDOS_ERASE_BATCH_SIZE", "500"))
+# how long erase waits before purging the user's tombstones, so every running replica
+# has polled them and dropped the user first (see user_state.py)
+TOMBSTONE_GRACE_SECONDS = float(os.getenv("KUDOS_ERASE_TOMBSTONE_GRACE", str(POLL_SECONDS * 2)))
+
+# everything we keep about someone. user_agreements and kudos_opt_out are keyed on user_id,
+# so they hold one row per user at most and don't need paging
+USER_TABLES = ("user_agreements", "kudos_opt_out")
+
+USER_ID = re.compile(r"[UW][A-Z0-9]+")
+COMMAND_PATTERN = re.compile(r"^\s*(export|erase)\s+(?:<@([A-Z0-9]+)(?:\|[^>]*)?>|([UW][A-Z0-9]+))\s*$", re.IGNORECASE)
+
+# export and erase a user's data without ever holding all of it. collect_kudos is read in
+# pages ordered by id, each page starting after the last id of the one before (keyset
+# pagination, so page 500 costs the same as page 1 and nothing hits the row cap), and
+# written out as NDJSON one row at a time. erasing deletes the same way, a batch at a time.
+#
+#   python user_data.py export U012ABCDEF > U012ABCDEF.ndjson
+#   python user_data.py erase U012ABCDEF
+
+
+def is_admin(user_id):
+    # KUDOS_ADMINS is a comma separated list of slack ids. read on every call so it doesn't matter when .env was loaded
+    return user_id in {admin.strip() for admin in os.getenv("KUDOS_ADMINS", "").split(",") if admin.strip()}
+
+
+def parse_command(text):
+    # "/kudos-data export @someone" -> ("export", "U..."), or None
+    match = COMMAND_PATTERN.match(text or "")
+    if not match:
+        return None
+    return match.group(1).lower(), match.group(2) or match.group(3)
+
+
+def _check_user_id(user_id):
+    # it ends up inside a postgrest or= filter, so only slack ids get through
+    if not USER_ID.fullmatch(user_id or ""):
+        raise ValueError(f"{user_id!r} doesn't look like a slack user id")
+
+
+def _their_kudos(query, user_id):
+    return query.or_(f"sender_id.eq.{user_id},recipient_id.eq.{user_id}")
+
+
+def iter_kudos(supabase, user_id, columns="*", page_size=EXPORT_PAGE_SIZE):
+    # every kudos the user sent or received, oldest first
+    _check_user_id(user_id)
+    last_id = 0
+    while True:
+        with track("supabase", "collect_kudos"):
+            rows = (
+                _their_kudos(supabase.table("collect_kudos").select(columns), user_id)
+                .gt("id", last_id)
+                .order("id")
+                .limit(page_size)
+                .execute()
+                .data
+            )
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def iter_user_rows(supabase, user_id, page_size=EXPORT_PAGE_SIZE):
+    for row in iter_kudos(supabase, user_id, page_size=page_size):
+        yield "collect_kudos", row
+    for table in USER_TABLES:
+        with track("supabase", table):
+            rows = supabase.table(table).select("*").eq("user_id", user_id).execute().data
+        for row in rows:
+            yield table, row
+
+
+def export_user(supabase, user_id, out, page_size=EXPORT_PAGE_SIZE):
+    # one {"table": ..., "row": {...}} per line. returns how many rows were written
+    written = 0
+    for table, row in iter_user_rows(supabase, user_id, page_size):
+        out.write(json.dumps({"table": table, "row": row}, default=str) + "\n")
+        written += 1
+    return written
+
+
+def export_to_file(supabase, user_id, directory):
+    # for uploading to slack. returns (path, rows written)
+    path = os.path.join(directory, f"kudos-{user_id}.ndjson")
+    with open(path, "w", encoding="utf-8") as out:
+        written = export_user(supabase, user_id, out)
+    return path, written
+
+
+def erase_user(supabase, user_id, keep_opt_out=True, batch_size=ERASE_BATCH_SIZE, digest=None, writer=None, spill_path=None, tombstone_grace=TOMBSTONE_GRACE_SECONDS):
+    # returns {table: rows deleted}. the opt-out row is kept by default, it's what stops
+    # the bot from sending them kudos again after their data is gone. pass the DigestBuffer
+    # to clear kudos_digest.db too, and the KudosWriter (or, outside the bot, its spill
+    # file) so kudos that aren't in supabase yet don't land after the delete
+    _check_user_id(user_id)
+    deleted = {}
+    if writer is not None:
+        deleted["kudos write queue"] = writer.forget(user_id)
+    elif spill_path is not None:
+        deleted["kudos_spill.db"] = forget_spilled(spill_path, user_id)
+
+    deleted["collect_kudos"] = 0
+    while True:
+        batch = list(islice(iter_kudos(supabase, user_id, columns="id", page_size=batch_size), batch_size))
+        if not batch:
+            break
+        # ids only go up and nothing older than the batch is left, so "up to the last id" is exactly this batch
+        with track("supabase", "collect_kudos.delete"):
+            (
+                _their_kudos(supabase.table("collect_kudos").delete(returning=ReturnMethod.minimal), user_id)
+                .lte("id", batch[-1]["id"])
+                .execute()
+            )
+        deleted["collect_kudos"] += len(batch)
+        if len(batch) < batch_size:
+            break
+
+    for table in USER_TABLES:
+        if table == "kudos_opt_out" and keep_opt_out:
+            continue
+        with track("supabase", f"{table}.delete"):
+            rows = supabase.table(table).delete().eq("user_id", user_id).execute().data
+        deleted[table] = len(rows)
+
+    # the deletes above left tombstones for the replicas. give them time to see those, then
+    # purge every tombstone with the user's id, older ones from opting in and out included
+    if deleted.get("user_agreements") or deleted.get("kudos_opt_out"):
+        time.sleep(tombstone_grace)
+    with track("supabase", "kudos_state_tombstones.delete"):
+        rows = supabase.table("kudos_state_tombstones").delete().eq("user_id", user_id).execute().data
+    deleted["kudos_state_tombstones"] = len(rows)
+
+    if digest is not None:
+        deleted["kudos_digest.db"] = digest.erase(user_id)
+    return deleted
+
+
+def _supabase_from_env():
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    return create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or erase everything KudosGiver stores about a user")
+    parser.add_argument("action", choices=["export", "erase"])
+    parser.add_argument("user_id", help="slack user id, like U012ABCDEF")
+    parser.add_argument("--out", help="file to export to (default stdout)")
+    parser.add_argument("--include-opt-out", action="store_true", help="erase the kudos_opt_out row too")
+    parser.add_argument("--yes", action="store_true", help="don't ask before erasing")
+    parser.add_argument("--digest-path", default=DIGEST_PATH, help="the bot's kudos_digest.db, cleared on erase (default KUDOS_DIGEST_PATH)")
+    parser.add_argument("--spill-path", default=SPILL_PATH, help="the bot's kudos_spill.db, cleared on erase (default KUDOS_SPILL_PATH)")
+    args = parser.parse_args(argv)
+
+    supabase = _supabase_from_env()
+    if args.action == "export":
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as out:
+                written = export_user(supabase, args.user_id, out)
+        else:
+            written = export_user(supabase, args.user_id, sys.stdout)
+        print(f"Exported {written} rows for {args.user_id}", file=sys.stderr)
+        return
+
+    if not args.yes and input(f"Erase all kudos data for {args.user_id}? [y/N] ").strip().lower() != "y":
+        print("Nothing erased")
+        return
+    # the digest file is local to the machine the bot runs on, so it's only cleared when it's here
+    digest = DigestBuffer(None, path=args.digest_path) if os.path.exists(args.digest_path) else None
+    if digest is None:
+        print(f"No {args.digest_path} here, run this on the bot's machine (or pass --digest-path) to clear buffered digests too", file=sys.stderr)
+    deleted = erase_user(supabase, args.user_id, keep_opt_out=not args.include_opt_out, digest=digest, spill_path=args.spill_path)
+    print(f"Erased {', '.join(f'{count} from {table}' for table, count in deleted.items())}")
+
+
+if __name__ == "__main__":
+    main()
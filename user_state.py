@@ -0,0 +1,222 @@
+import os
+import threading
+from collections import OrderedDict
+from metrics import track
+
+POLL_SECONDS = float(os.getenv("REPLICA_POLL_SECONDS", "5"))
+LAST_KNOWN_SIZE = int(os.getenv("GATE_LAST_KNOWN_SIZE", "20000"))
+PAGE_SIZE = 1000
+
+
+class UserStateReplica:
+    # keeps a local copy of kudos_opt_out and user_agreements so the gate checks
+    # don't need a supabase round trip. deletes come in through kudos_state_tombstones.
+
+    def __init__(self, supabase, poll_seconds=POLL_SECONDS):
+        self.supabase = supabase
+        self.poll_seconds = poll_seconds
+        self.opted_out = set()
+        self.agreed = set()
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cursors = {"kudos_opt_out": None, "user_agreements": None}
+        self._tombstone_id = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sets(self):
+        return {"kudos_opt_out": self.opted_out, "user_agreements": self.agreed}
+
+    def _rows_after(self, table, cursor):
+        # every row after the (created_at, user_id) cursor, a page at a time. created_at
+        # isn't unique, so user_id breaks ties and a page never ends halfway through a
+        # timestamp it can't get past
+        rows = []
+        while True:
+            query = self.supabase.table(table).select("user_id, created_at").order("created_at").order("user_id").limit(PAGE_SIZE)
+            if cursor:
+                created_at, user_id = cursor
+                query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",user_id.gt.{user_id})')
+            with track("supabase", table):
+                page = query.execute().data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            cursor = (page[-1]["created_at"], page[-1]["user_id"])
+
+    def _tombstones_after(self, tombstone_id):
+        rows = []
+        while True:
+            with track("supabase", "kudos_state_tombstones"):
+                page = self.supabase.table("kudos_state_tombstones").select("id, table_name, user_id, deleted_at").gt("id", tombstone_id).order("id").limit(PAGE_SIZE).execute().data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            tombstone_id = page[-1]["id"]
+
+    def load(self):
+        # grab the tombstone cursor first so nothing deleted during the load gets lost
+        with track("supabase", "kudos_state_tombstones"):
+            response = self.supabase.table("kudos_state_tombstones").select("id").order("id", desc=True).limit(1).execute()
+        tombstone_id = response.data[0]["id"] if response.data else 0
+
+        loaded = {}
+        cursors = {}
+        for table in self._cursors:
+            rows = self._rows_after(table, None)
+            loaded[table] = {row["user_id"] for row in rows}
+            cursors[table] = (rows[-1]["created_at"], rows[-1]["user_id"]) if rows else None
+
+        with self._lock:
+            self.opted_out = loaded["kudos_opt_out"]
+            self.agreed = loaded["user_agreements"]
+            self._cursors = cursors
+            self._tombstone_id = tombstone_id
+            self.ready = True
+
+    def sync(self):
+        events = []
+        for table, cursor in self._cursors.items():
+            for row in self._rows_after(table, cursor):
+                events.append((row["created_at"], table, row["user_id"], True))
+
+        tombstones = self._tombstones_after(self._tombstone_id)
+        for row in tombstones:
+            events.append((row["deleted_at"], row["table_name"], row["user_id"], False))
+
+        events.sort(key=lambda event: event[0])
+
+        with self._lock:
+            sets = self._sets()
+            for created_at, table, user_id, present in events:
+                if table not in sets:
+                    continue
+                if present:
+                    sets[table].add(user_id)
+                    # rows come in (created_at, user_id) order and the sort is stable, so the last one wins
+                    self._cursors[table] = (created_at, user_id)
+                else:
+                    sets[table].discard(user_id)
+            if tombstones:
+                self._tombstone_id = tombstones[-1]["id"]
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                if self.ready:
+                    self.sync()
+                else:
+                    self.load()
+            except Exception as e:
+                print(f"Replica sync failed {e}")
+
+    def start(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Unable to load user state replica, falling back to supabase. {e}")
+        self._thread = threading.Thread(target=self._run, name="user-state-replica", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # write-through, so the user sees their own change before the next poll
+
+    def mark_opted_out(self, user_id):
+        with self._lock:
+            self.opted_out.add(user_id)
+            self.agreed.discard(user_id)
+
+    def mark_opted_in(self, user_id):
+        with self._lock:
+            self.opted_out.discard(user_id)
+
+    def mark_agreed(self, user_id):
+        with self._lock:
+            self.agreed.add(user_id)
+
+    def mark_not_agreed(self, user_id):
+        with self._lock:
+            self.agreed.discard(user_id)
+
+    def opted_out_among(self, user_ids):
+        # which of these users opted out, or None when the replica isn't loaded yet
+        if not self.ready:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {user_id for user_id in user_ids if user_id in self.opted_out}
+
+    def lookup(self, sender_id, recipient_id=None):
+        # gate state from the replica, or None when it isn't loaded and the caller has to ask supabase
+        if not self.ready:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            "sender_opted_out": sender_id in self.opted_out,
+            "sender_agreed": sender_id in self.agreed,
+            "recipient_opted_out": recipient_id is not None and recipient_id in self.opted_out,
+        }
+
+    def is_opted_out(self, user_id):
+        return user_id in self.opted_out
+
+
+class LastKnownState:
+    # the last opt-out/agreement answer supabase gave for each user, kept for when it's
+    # unreachable (or its circuit breaker is open). bounded LRU, oldest users fall off first.
+
+    def __init__(self, max_size=LAST_KNOWN_SIZE):
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set(self, user_id, **facts):
+        # called with the lock held
+        entry = self._users.setdefault(user_id, {})
+        entry.update(facts)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def _get(self, user_id, fact, default):
+        entry = self._users.get(user_id)
+        return entry.get(fact, default) if entry else default
+
+    def remember(self, sender_id, recipient_id, state):
+        with self._lock:
+            self._set(sender_id, opted_out=state["sender_opted_out"], agreed=state["sender_agreed"])
+            if recipient_id is not None:
+                self._set(recipient_id, opted_out=state["recipient_opted_out"])
+
+    def mark(self, user_id, **facts):
+        # write-through for the user's own changes, like UserStateReplica.mark_*
+        with self._lock:
+            self._set(user_id, **facts)
+
+    def remember_opted_out(self, user_ids, opted_out):
+        with self._lock:
+            for user_id in user_ids:
+                self._set(user_id, opted_out=user_id in opted_out)
+
+    def state(self, sender_id, recipient_id=None):
+        # None when we never saw whether the sender agreed. the gate is there to make sure they
+        # did, so an outage doesn't get to assume it, they're asked to try again instead
+        with self._lock:
+            sender_opted_out = self._get(sender_id, "opted_out", False)
+            sender_agreed = self._get(sender_id, "agreed", None)
+            if sender_agreed is None and not sender_opted_out:
+                return None
+            return {
+                "sender_opted_out": sender_opted_out,
+                "sender_agreed": bool(sender_agreed),
+                "recipient_opted_out": recipient_id is not None and self._get(recipient_id, "opted_out", False),
+            }
+
+    def opted_out_among(self, user_ids):
+        with self._lock:
+            return {user_id for user_id in user_ids if self._get(user_id, "opted_out", False)}